@@ -1,62 +1,332 @@
+import json
+import mimetypes
+import os
+import time
+from datetime import datetime
+
+from catalog_export import CatalogExport
+from catalog_version import CatalogVersion
 from db.base_model import db
-from flask import Flask, request, send_from_directory
+from flask import (Flask, Response, abort, make_response, request,
+                   send_file, stream_with_context)
 from flask_cors import CORS
-from peewee import DoesNotExist
-from product import Product, Tag, Color
+from pagination import Paginator
+from peewee import DoesNotExist, IntegrityError
+from product import Product, ProductSearch, Tag, Color
+from product_facets import ProductFacets
+from filter_cache import filter_cache
 from product_filter import ProductFilterEngine
-from searches import Searches
+from product_index import product_index
+from product_ranking import ProductRanking
+from rating_progress import RatingProgress
+from rating_queue import RatingQueue
+from request_metrics import RequestMetrics
+from response_cache import response_cache
+from searches import MaterializedSearches, Searches
+from snapshot_cache import snapshot_cache
+from static_files import StaticFiles
+from werkzeug.security import safe_join
+
+app = Flask(__name__, static_folder=None)
+CORS(
+    app, resources={r'/*': {'origin': '*'}},
+    expose_headers=['X-Next-Cursor', 'X-Sync-Until', 'ETag']
+)
+
+request_metrics = RequestMetrics(db, {
+    'filter': filter_cache,
+    'response': response_cache,
+    'snapshot': snapshot_cache
+})
+request_metrics.init_app(app)
+
+NDJSON_CHUNK_SIZE: int = 100
+STATIC_DIRECTORY: str = os.path.join(app.root_path, 'static')
+STATIC_ACCEL_PREFIX_VARIABLE: str = 'STATIC_ACCEL_PREFIX'
+IMMUTABLE_CACHE_CONTROL: str = 'public, max-age=31536000, immutable'
+app.config['USE_X_SENDFILE'] = os.environ.get('STATIC_X_SENDFILE') == '1'
+UNSYNCED_ENDPOINTS: list[str] = ['route_static', 'metrics']
+# A delta sync must return every changed row, or the client would skip
+# rows up to the X-Sync-Until watermark that it was never sent.
+TRUNCATING_ARGUMENTS: list[str] = ['limit', 'cursor', 'rank']
+
+
+@app.before_request
+def _connect_db():
+    if request.endpoint in UNSYNCED_ENDPOINTS:
+        return
+    db.connect(reuse_if_open=True)
+    if product_index.sync():
+        RatingProgress.reset()
 
-app = Flask(__name__)
-CORS(app, resources={r'/*': {'origin': '*'}})
+
+@app.teardown_request
+def _close_db(exception: BaseException):
+    if not db.is_closed():
+        db.close()
+
+
+def _encoded_products(ids: list[str], fields: list[str]) -> list[bytes]:
+    fields_key = None if fields is None else tuple(fields)
+    updated_ats = {}
+    for i in range(0, len(ids), product_index.HYDRATION_CHUNK_SIZE):
+        updated_ats.update(
+            Product.select(Product.id_, Product.updated_at)
+            .where(
+                Product.id_.in_(ids[i:i + product_index.HYDRATION_CHUNK_SIZE])
+            )
+            .tuples()
+        )
+
+    fragments = {}
+    missing_ids = []
+    for id_, updated_at in updated_ats.items():
+        fragment = snapshot_cache.get(id_, updated_at, fields_key)
+        if fragment is None:
+            missing_ids.append(id_)
+        else:
+            fragments[id_] = fragment
+
+    products = product_index.hydrate(missing_ids, fields)
+    for product, values in zip(products, Product.to_dicts(products, fields)):
+        fragment = json.dumps(values).encode()
+        fragments[product.id_] = fragment
+        snapshot_cache.put(
+            product.id_, updated_ats[product.id_], fragment, fields_key
+        )
+
+    return [fragments[id_] for id_ in ids if id_ in fragments]
+
+
+def _ndjson_products(ids: list[str], fields: list[str]):
+    for i in range(0, len(ids), NDJSON_CHUNK_SIZE):
+        for fragment in _encoded_products(
+            ids[i:i + NDJSON_CHUNK_SIZE], fields
+        ):
+            yield fragment + b"\n"
+
+
+def _products_response(ids: list[str], wrapped: bool):
+    headers = {}
+    try:
+        fields = Product.parse_fields(request.args.get('fields'))
+        if request.args.get('rank') is not None:
+            ids = ProductRanking.from_args(product_index, request.args).top(
+                ids
+            )
+        else:
+            paginator = Paginator.from_args(product_index, request.args)
+            ids = paginator.page(ids)
+            if paginator.next_cursor is not None:
+                headers['X-Next-Cursor'] = paginator.next_cursor
+    except ValueError as error:
+        return {'success': False, 'message': str(error)}, 400
+
+    if request.args.get('format') == 'ndjson':
+        return Response(
+            stream_with_context(_ndjson_products(ids, fields)),
+            mimetype='application/x-ndjson',
+            headers=headers
+        )
+
+    products = b"[" + b",".join(_encoded_products(ids, fields)) + b"]"
+    return Response(
+        b'{"products": ' + products + b"}" if wrapped else products,
+        mimetype='application/json',
+        headers=headers
+    )
+
+
+def _explain_response(engine: ProductFilterEngine):
+    explanation = engine.explain()
+    start = time.perf_counter()
+    products = product_index.hydrate(engine.ids)
+    explanation['timings']['hydrate'] = time.perf_counter() - start
+    start = time.perf_counter()
+    products = Product.to_dicts(products)
+    explanation['timings']['to_dict'] = time.perf_counter() - start
+    return {'products': products, 'explain': explanation}, 200
 
 
 @app.route("/products", methods=['GET'])
+@response_cache.cached
 def route_products():
-    products = Product.select()
-    return [p.to_dict() for p in products], 200
+    if (since := request.args.get('since')) is None:
+        ids = [id_ for (id_,) in Product.select(Product.id_).tuples()]
+        return _products_response(ids, wrapped=False)
+
+    try:
+        since = datetime.fromisoformat(since)
+    except ValueError:
+        return {'success': False, 'message': f"Invalid since: {since}"}, 400
+    if (truncating := [
+        argument for argument in TRUNCATING_ARGUMENTS
+        if argument in request.args
+    ]):
+        return {
+            'success': False,
+            'message': f"since cannot be combined with: {truncating}"
+        }, 400
+    # The boundary is inclusive so that rows written in the same
+    # microsecond as the last sync are not lost.
+    changes = list(
+        Product.select(Product.id_, Product.updated_at)
+        .where(Product.updated_at >= since)
+        .order_by(Product.updated_at)
+        .tuples()
+    )
+    until = changes[-1][1] if changes else since
+    response = make_response(
+        _products_response([id_ for id_, _ in changes], wrapped=False)
+    )
+    if response.status_code == 200:
+        response.headers['X-Sync-Until'] = until.isoformat()
+    return response
+
+
+def _update_product(
+    product: Product, values: dict[str, any]
+) -> tuple[bool, bool, list[str]]:
+    before = RatingProgress.snapshot(product)
+    for key, value in values.items():
+        product.update_field(key, value)
+    product.save(force_insert=False)
+    MaterializedSearches.refresh_product(product)
+    return before
+
+
+def _publish_update(product: Product, before: tuple[bool, bool, list[str]]):
+    # In-memory state must only see committed rows, so this runs after
+    # the transaction.
+    RatingProgress.record_change(before, RatingProgress.snapshot(product))
+    product_index.refresh(product)
+    CatalogVersion.committed(product.catalog_version)
+
+
+@app.route("/products", methods=['PATCH'])
+def route_products_bulk_update():
+    updates = request.get_json()
+    if not isinstance(updates, list) or not all(
+        isinstance(update, dict) and 'id_' in update for update in updates
+    ):
+        return {
+            'success': False,
+            'message': "Expected a list of updates with an id_!"
+        }, 400
+    ids = [update['id_'] for update in updates]
+    products = {product.id_: product for product in product_index.hydrate(ids)}
+    if (missing := [id_ for id_ in ids if id_ not in products]):
+        return {
+            'success': False, 'message': f"No such products: {missing}"
+        }, 404
+    befores = {}
+    try:
+        with db.atomic():
+            for update in updates:
+                values = {
+                    key: value for key, value in update.items()
+                    if key != 'id_'
+                }
+                befores.setdefault(
+                    update['id_'],
+                    _update_product(products[update['id_']], values)
+                )
+    except (KeyError, TypeError, ValueError, IntegrityError) as error:
+        return {'success': False, 'message': str(error)}, 400
+    for id_, before in befores.items():
+        _publish_update(products[id_], before)
+    return {'success': True, 'updated': len(updates)}, 200
 
 
 @app.route("/product/<pid>", methods=['GET', 'PATCH'])
 def route_product_data(pid: str):
+    fields = None
+    if request.method == 'GET':
+        try:
+            fields = Product.parse_fields(request.args.get('fields'))
+        except ValueError as error:
+            return {'success': False, 'message': str(error)}, 400
+
     try:
-        product = Product.get(Product.id_ == pid)
+        product = (
+            Product.select(*Product.select_columns(fields))
+            .where(Product.id_ == pid)
+            .get()
+        )
     except DoesNotExist:
         return {'success': False, 'message': "No such product!"}, 404
 
     if request.method == 'GET':
-        return product.to_dict()
+        if fields is not None:
+            return product.to_dict(fields)
+        return {**product.to_dict(), 'plots': product.plot_urls()}
 
     elif request.method == 'PATCH':
-        for key, value in request.get_json().items():
-            product.update_field(key, value)
-        product.save(force_insert=False)
+        values = request.get_json()
+        if not isinstance(values, dict):
+            return {'success': False, 'message': "Expected an object!"}, 400
+        try:
+            with db.atomic():
+                before = _update_product(product, values)
+        except (KeyError, TypeError, ValueError, IntegrityError) as error:
+            return {'success': False, 'message': str(error)}, 400
+        _publish_update(product, before)
         return {'success': True}
 
 
 @app.route("/product/next-unrated", methods=['GET'])
 def route_product_next_unrated():
     excluded_pid = request.args.get('excluded') or None
-    try:
-        product = (
-            Product.get(
-                Product.id_ != excluded_pid,
-                Product.rated == False  # noqa: E712
-            )
-            if excluded_pid
-            else Product.get(Product.rated == False)  # noqa: E712
-        )
-    except DoesNotExist:
+    ids = RatingQueue.next_ids(1, [excluded_pid] if excluded_pid else None)
+    if not ids:
         return {'success': False, 'message': "No more unrated products!"}, 404
-    return product.to_dict(), 200
+    return Product.to_dicts(product_index.hydrate(ids))[0], 200
+
+
+@app.route("/rating-queue", methods=['GET'])
+def route_rating_queue():
+    excluded = request.args.get('excluded')
+    try:
+        limit = int(request.args.get('limit', RatingQueue.DEFAULT_LIMIT))
+    except ValueError:
+        return {'success': False, 'message': "Invalid limit!"}, 400
+    ids = RatingQueue.next_ids(
+        limit, excluded.split(',') if excluded else None
+    )
+    return RatingQueue.serialize(ids), 200
+
+
+@app.route("/suggest-products", methods=['GET'])
+def route_suggest_products():
+    prefix = request.args.get('prefix', '')
+    try:
+        limit = int(request.args.get(
+            'limit', ProductSearch.DEFAULT_SUGGESTION_LIMIT
+        ))
+    except ValueError:
+        return {'success': False, 'message': "Invalid limit!"}, 400
+    return [
+        {'id_': product_id, 'short_name': short_name}
+        for product_id, short_name
+        in ProductSearch.suggest(prefix, limit).tuples()
+    ], 200
+
+
+@app.route("/catalog", methods=['GET'])
+@response_cache.cached
+def route_catalog():
+    return Response(CatalogExport().encode(), mimetype=CatalogExport.MIMETYPE)
 
 
 @app.route("/tags", methods=['GET'])
+@response_cache.cached
 def route_tags():
     tags = Tag.select()
     return [tag.name for tag in tags], 200
 
 
 @app.route("/colors", methods=['GET'])
+@response_cache.cached
 def route_colors():
     colors = Color.select()
     return [color.name for color in colors], 200
@@ -71,49 +341,63 @@ def route_text_fields():
 
 @app.route("/boolean-fields", methods=['GET'])
 def route_boolean_fields():
-    return [
-        "is_new", "rated", "fan", "availability", "rating"
-    ], 200
+    return ProductFacets.BOOLEAN_FIELDS, 200
 
 
 @app.route("/number-fields", methods=['GET'])
 def route_number_fields():
-    return [
-        "price", "weight", "min_caliber", "max_caliber", "min_height",
-        "max_height", "duration", "nem",
-        "package_size", "nem_per_second", "nem_per_shot", "shots_per_second",
-        "price_per_shot", "price_per_second", "price_per_nem", "shot_count"
-    ], 200
+    return ProductFacets.NUMBER_FIELDS, 200
 
 
 @app.route("/find-products", methods=['POST'])
+@response_cache.cached
 def route_find_products():
-    print(request.json)
     filters_ = request.json['filters']
     inverted = request.json['inverted']
-    engine = ProductFilterEngine(filters_, inverted)
+    explain = request.args.get('explain') == 'true'
+    engine = ProductFilterEngine(
+        filters_, inverted, cache=filter_cache, profile=explain
+    )
     engine.run()
-    return {'products': [
-        product.to_dict()
-        for product in engine.products
-    ]}, 200
+    if explain:
+        return _explain_response(engine)
+    return _products_response(engine.ids, wrapped=True)
 
 
-@app.route("/progress", methods=['GET'])
-def route_progress():
-    products = Product.select()
-    product_count = len(products)
-    rated_count = len([p for p in products if p.rated])
+@app.route("/find-products/facets", methods=['POST'])
+def route_find_products_facets():
+    engine = ProductFilterEngine(
+        request.json['filters'], request.json['inverted'],
+        cache=filter_cache
+    )
+    engine.run()
+    return ProductFacets.compute(product_index, engine.ids), 200
+
+
+@app.route("/find-products/batch", methods=['POST'])
+def route_find_products_batch():
+    engines = ProductFilterEngine.run_batch(
+        request.json['queries'], cache=filter_cache
+    )
+    ids = list(dict.fromkeys(id_ for engine in engines for id_ in engine.ids))
     return {
-        'rating_progress': rated_count,
-        'product_count': product_count
+        'results': [engine.ids for engine in engines],
+        'products': Product.to_dicts(product_index.hydrate(ids))
     }, 200
 
 
+@app.route("/progress", methods=['GET'])
+def route_progress():
+    return RatingProgress.get(), 200
+
+
 @app.route("/searches", methods=['GET', 'POST'])
 def route_searches():
     if request.method == 'GET':
-        return {'searches': Searches.get_all_search_names()}, 200
+        return {
+            'searches': Searches.get_all_search_names(),
+            'materialized': MaterializedSearches.get_all_names()
+        }, 200
     elif request.method == 'POST':
         search_name = request.json['search_name']
         search = request.json['search']
@@ -133,14 +417,89 @@ def route_search(search_name: str):
         return {'search': search}, 200
 
 
+@app.route("/searches/<search_name>/materialized", methods=['PUT'])
+def route_search_materialized(search_name: str):
+    if Searches.get_search(search_name) is None:
+        return {'success': False, 'message': "No such search!"}, 404
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(
+        body.get('materialized'), bool
+    ):
+        return {
+            'success': False,
+            'message': "Expected an object with a boolean materialized!"
+        }, 400
+    if body['materialized']:
+        MaterializedSearches.materialize(search_name)
+    else:
+        MaterializedSearches.dematerialize(search_name)
+    return {'success': True}, 200
+
+
+@app.route("/searches/<search_name>/products", methods=['GET'])
+def route_search_products(search_name: str):
+    if MaterializedSearches.is_materialized(search_name):
+        return _products_response(
+            MaterializedSearches.get_ids(search_name), wrapped=True
+        )
+    search = Searches.get_search(search_name)
+    if search is None:
+        return {'success': False, 'message': "No such search!"}, 404
+    engine = ProductFilterEngine(
+        search['filters'], search['inverted'], cache=filter_cache
+    )
+    engine.run()
+    return _products_response(engine.ids, wrapped=True)
+
+
 @app.route('/static/<path:path>')
 def route_static(path):
-    return send_from_directory('static', path)
+    filename = safe_join(STATIC_DIRECTORY, path)
+    if filename is None or not os.path.isfile(filename):
+        abort(404)
+
+    digest, encoding, sent_filename = None, None, filename
+    if StaticFiles.is_compressible(filename):
+        digest = StaticFiles.digest(filename)
+        for candidate in StaticFiles.ENCODINGS:
+            if (
+                request.accept_encodings[candidate]
+                and (variant := StaticFiles.variant(filename, candidate))
+            ):
+                encoding, sent_filename = candidate, variant
+                break
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    if (accel_prefix := os.environ.get(STATIC_ACCEL_PREFIX_VARIABLE)):
+        relative_path = os.path.relpath(sent_filename, STATIC_DIRECTORY)
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = (
+            f"{accel_prefix}/{relative_path}"
+        )
+    else:
+        response = send_file(
+            sent_filename, mimetype=mimetype, conditional=True,
+            download_name=os.path.basename(filename),
+            etag=(
+                True if digest is None
+                else f"{digest}-{encoding or StaticFiles.IDENTITY}"
+            )
+        )
+
+    if digest is not None:
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+    # Plot URLs carry their content digest, so they never change.
+    response.headers['Cache-Control'] = (
+        IMMUTABLE_CACHE_CONTROL
+        if digest is not None and request.args.get('v') == digest
+        else 'no-cache'
+    )
+    return response
 
 
 if __name__ == "__main__":
-    db.connect()
-    try:
-        app.run("0.0.0.0", 5000, debug=True)
-    except KeyboardInterrupt:
-        db.close()
+    with db.connection_context():
+        product_index.build()
+    app.run("0.0.0.0", 5000, debug=True)
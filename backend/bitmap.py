@@ -0,0 +1,70 @@
+from __future__ import annotations
+import numpy as np
+
+
+class Bitmap:
+
+    _bits: np.ndarray
+    _size: int
+
+    def __init__(self, bits: np.ndarray, size: int):
+        self._bits = bits
+        self._size = size
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> Bitmap:
+        return cls(np.packbits(mask), len(mask))
+
+    @classmethod
+    def from_ordinals(cls, ordinals: list[int], size: int) -> Bitmap:
+        mask = np.zeros(size, dtype=np.bool_)
+        mask[ordinals] = True
+        return cls.from_mask(mask)
+
+    @classmethod
+    def empty(cls, size: int) -> Bitmap:
+        return cls(np.zeros((size + 7) // 8, dtype=np.uint8), size)
+
+    @classmethod
+    def full(cls, size: int) -> Bitmap:
+        return ~cls.empty(size)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _aligned(self, other: Bitmap) -> tuple[np.ndarray, np.ndarray, int]:
+        if self._size == other._size:
+            return self._bits, other._bits, self._size
+        size = max(self._size, other._size)
+        a = np.zeros((size + 7) // 8, dtype=np.uint8)
+        b = np.zeros((size + 7) // 8, dtype=np.uint8)
+        a[:len(self._bits)] = self._bits
+        b[:len(other._bits)] = other._bits
+        return a, b, size
+
+    def __and__(self, other: Bitmap) -> Bitmap:
+        a, b, size = self._aligned(other)
+        return Bitmap(a & b, size)
+
+    def __or__(self, other: Bitmap) -> Bitmap:
+        a, b, size = self._aligned(other)
+        return Bitmap(a | b, size)
+
+    def __invert__(self) -> Bitmap:
+        bits = ~self._bits
+        if (padding := len(bits) * 8 - self._size) and len(bits):
+            bits[-1] &= (0xFF << padding) & 0xFF
+        return Bitmap(bits, self._size)
+
+    def __len__(self) -> int:
+        return int(np.unpackbits(self._bits).sum())
+
+    def __bool__(self) -> bool:
+        return bool(self._bits.any())
+
+    def mask(self) -> np.ndarray:
+        return np.unpackbits(self._bits, count=self._size).astype(np.bool_)
+
+    def ordinals(self) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(self._bits, count=self._size))
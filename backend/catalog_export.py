@@ -0,0 +1,163 @@
+import json
+import struct
+
+import numpy as np
+from db.base_model import BaseModel
+from peewee import BooleanField, FloatField, IntegerField
+from product import Color, ColorXProduct, Product, Tag, TagXProduct
+
+
+# Layout (all integers little-endian, every buffer 8-byte aligned):
+#
+#   magic        8 bytes  b"FWCAT\0\0\1"
+#   header_size  uint32
+#   header       header_size bytes of UTF-8 JSON
+#   padding      up to the next multiple of 8
+#   buffers      referenced by the header as [offset, length] pairs,
+#                offsets relative to the start of the buffer section
+#
+# The header is {"row_count": n, "columns": [...]}. Every column has a
+# "name", a "type" and a "validity" buffer: a bitmap with bit i
+# (np.packbits, little bit order) set when row i is not null.
+#
+#   int64 / float64  "values": n fixed-width values, 0 where null
+#   bool             "values": bitmap in the validity bit order
+#   string           "offsets": n + 1 uint32 byte offsets into "data",
+#                    "data": UTF-8 string table
+#   dictionary       "dictionary": list of names in the header,
+#                    "offsets": n + 1 uint32 offsets into "codes",
+#                    "codes": uint16 indices into the dictionary
+class CatalogExport:
+
+    MAGIC: bytes = b"FWCAT\0\0\1"
+    ALIGNMENT: int = 8
+    MIMETYPE: str = 'application/vnd.firework-rating.catalog'
+    RELATIONS: dict[str, tuple[BaseModel, BaseModel]] = {
+        'tags': (Tag, TagXProduct),
+        'colors': (Color, ColorXProduct)
+    }
+
+    _buffers: list[bytes]
+    _size: int
+
+    def __init__(self):
+        self._buffers = []
+        self._size = 0
+
+    def _add_buffer(self, buffer: bytes) -> list[int]:
+        location = [self._size, len(buffer)]
+        padding = -len(buffer) % self.ALIGNMENT
+        self._buffers.append(buffer + b"\0" * padding)
+        self._size += len(buffer) + padding
+        return location
+
+    def _bitmap(self, mask: np.ndarray) -> list[int]:
+        return self._add_buffer(
+            np.packbits(mask, bitorder='little').tobytes()
+        )
+
+    def _column_type(self, field_name: str) -> str:
+        field = getattr(Product, field_name)
+        if isinstance(field, BooleanField):
+            return 'bool'
+        if isinstance(field, FloatField):
+            return 'float64'
+        if isinstance(field, IntegerField):
+            return 'int64'
+        return 'string'
+
+    def _encode_column(
+        self, field_name: str, values: list[any]
+    ) -> dict[str, any]:
+        column_type = self._column_type(field_name)
+        validity = np.array(
+            [value is not None for value in values], dtype=np.bool_
+        )
+        column = {
+            'name': field_name,
+            'type': column_type,
+            'validity': self._bitmap(validity)
+        }
+        if column_type == 'string':
+            data = [
+                b"" if value is None else value.encode() for value in values
+            ]
+            offsets = np.zeros(len(data) + 1, dtype='<u4')
+            np.cumsum([len(item) for item in data], out=offsets[1:])
+            column['offsets'] = self._add_buffer(offsets.tobytes())
+            column['data'] = self._add_buffer(b"".join(data))
+        elif column_type == 'bool':
+            column['values'] = self._bitmap(
+                np.array([bool(value) for value in values], dtype=np.bool_)
+            )
+        else:
+            column['values'] = self._add_buffer(np.array(
+                [0 if value is None else value for value in values],
+                dtype='<i8' if column_type == 'int64' else '<f8'
+            ).tobytes())
+        return column
+
+    def _encode_relation(
+        self, name: str, table: BaseModel, x_table: BaseModel,
+        ids: list[str]
+    ) -> dict[str, any]:
+        dictionary = [row.name for row in table.select().order_by(table.name)]
+        codes = {entry: code for code, entry in enumerate(dictionary)}
+        memberships = {}
+        for id_, entry in (
+            x_table.select(x_table.product, table.name)
+            .join(table)
+            .tuples()
+        ):
+            memberships.setdefault(id_, []).append(codes[entry])
+        lists = [sorted(memberships.get(id_, [])) for id_ in ids]
+        offsets = np.zeros(len(lists) + 1, dtype='<u4')
+        np.cumsum([len(item) for item in lists], out=offsets[1:])
+        return {
+            'name': name,
+            'type': 'dictionary',
+            'validity': self._bitmap(np.ones(len(ids), dtype=np.bool_)),
+            'dictionary': dictionary,
+            'offsets': self._add_buffer(offsets.tobytes()),
+            'codes': self._add_buffer(np.array(
+                [code for item in lists for code in item], dtype='<u2'
+            ).tobytes())
+        }
+
+    def encode(self) -> bytes:
+        field_names = [
+            field_name for field_name in Product.SERIALIZED_FIELDS
+            if field_name not in Product.RELATION_FIELDS
+        ]
+        rows = list(
+            Product.select(
+                *[getattr(Product, field_name) for field_name in field_names]
+            )
+            .order_by(Product.id_)
+            .tuples()
+        )
+        columns = [
+            self._encode_column(field_name, list(values))
+            for field_name, values in zip(
+                field_names, zip(*rows) if rows else [[]] * len(field_names)
+            )
+        ]
+        ids = [row[field_names.index('id_')] for row in rows]
+        columns.extend(
+            self._encode_relation(name, table, x_table, ids)
+            for name, (table, x_table) in self.RELATIONS.items()
+        )
+
+        header = json.dumps(
+            {'row_count': len(rows), 'columns': columns}
+        ).encode()
+        padding = -(len(self.MAGIC) + 4 + len(header)) % self.ALIGNMENT
+        return b"".join([
+            self.MAGIC, struct.pack('<I', len(header)), header,
+            b"\0" * padding, *self._buffers
+        ])
+
+    @classmethod
+    def export(cls, filename: str):
+        with open(filename, 'wb') as file:
+            file.write(cls().encode())
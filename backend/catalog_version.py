@@ -0,0 +1,64 @@
+from threading import Lock
+
+from db.base_model import BaseModel, db
+from peewee import IntegerField
+
+
+class CatalogState(BaseModel):
+    ROW_ID: str = 'catalog'
+
+    version = IntegerField(default=0)
+
+
+class CatalogVersion:
+
+    _version: int = 0
+    _own_versions: set[int] = set()
+    _lock: Lock = Lock()
+
+    @staticmethod
+    def shared() -> int:
+        return (
+            CatalogState.select(CatalogState.version)
+            .where(CatalogState.id_ == CatalogState.ROW_ID)
+            .scalar()
+        ) or 0
+
+    @classmethod
+    def bump(cls) -> int:
+        # The update holds SQLite's write lock until the surrounding
+        # transaction commits, so versions commit in increasing order.
+        with db.atomic():
+            CatalogState.update(version=CatalogState.version + 1).where(
+                CatalogState.id_ == CatalogState.ROW_ID
+            ).execute()
+            return cls.shared()
+
+    @classmethod
+    def committed(cls, version: int):
+        with cls._lock:
+            cls._version += 1
+            cls._own_versions.add(version)
+
+    @classmethod
+    def advance(cls, applied: int, shared: int) -> bool:
+        with cls._lock:
+            own_count = sum(
+                applied < version <= shared for version in cls._own_versions
+            )
+            cls._own_versions = {
+                version for version in cls._own_versions if version > shared
+            }
+            if shared - applied == own_count:
+                return False
+            cls._version += 1
+            return True
+
+    @classmethod
+    def get(cls) -> int:
+        return cls._version
+
+    @staticmethod
+    def create_state():
+        CatalogState.create_table()
+        CatalogState.get_or_create(id_=CatalogState.ROW_ID)
@@ -1,10 +1,44 @@
 from datetime import datetime
+from threading import local
 from uuid import uuid4
 
-from peewee import DateTimeField, Field, Model, SqliteDatabase, TextField
+from peewee import DateTimeField, Field, Model, TextField
+from playhouse.pool import PooledSqliteDatabase
 
 DATABASE_FILENAME: str = "backend/db/db.sqlite3"
-db: SqliteDatabase = SqliteDatabase(DATABASE_FILENAME)
+DATABASE_PRAGMAS: dict[str, any] = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -16 * 1024,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'memory'
+}
+
+
+class QueryCountingDatabase(PooledSqliteDatabase):
+
+    _query_counts: local
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._query_counts = local()
+
+    @property
+    def query_count(self) -> int:
+        return getattr(self._query_counts, 'count', 0)
+
+    def reset_query_count(self):
+        self._query_counts.count = 0
+
+    def execute_sql(self, sql: str, params: tuple = None, commit=None):
+        self._query_counts.count = self.query_count + 1
+        return super().execute_sql(sql, params, commit)
+
+
+db: QueryCountingDatabase = QueryCountingDatabase(
+    DATABASE_FILENAME, pragmas=DATABASE_PRAGMAS, timeout=10,
+    max_connections=32, stale_timeout=300, check_same_thread=False
+)
 
 
 class BaseModel(Model):
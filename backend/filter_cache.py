@@ -0,0 +1,73 @@
+import sys
+from collections import OrderedDict
+from threading import Lock
+
+
+class FilterCache:
+
+    DEFAULT_MAX_BYTES: int = 32 * 1024 * 1024
+
+    _entries: OrderedDict[str, tuple[list[str], int]]
+    _version: int
+    _max_bytes: int
+    _bytes: int
+    _lock: Lock
+    hits: int
+    misses: int
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._entries = OrderedDict()
+        self._version = None
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def _entry_size(self, key: str, ids: list[str]) -> int:
+        return (
+            sys.getsizeof(key) + sys.getsizeof(ids)
+            + sum(sys.getsizeof(id_) for id_ in ids)
+        )
+
+    def _check_version(self, version: int):
+        if version != self._version:
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key: str, version: int) -> list[str]:
+        with self._lock:
+            self._check_version(version)
+            if (entry := self._entries.get(key)) is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, version: int, ids: list[str]):
+        size = self._entry_size(key, ids)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if (entry := self._entries.pop(key, None)) is not None:
+                self._bytes -= entry[1]
+            self._entries[key] = (ids, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+filter_cache: FilterCache = FilterCache()
@@ -0,0 +1,39 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(
+    os.environ.get('WORKERS', min(4, multiprocessing.cpu_count()))
+)
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', '8'))
+pythonpath = 'backend'
+wsgi_app = 'app:app'
+accesslog = '-'
+# Workers inherit this before they import prometheus_client, so each
+# writes its metrics to the shared directory.
+metrics_directory = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'firework-rating-metrics')
+)
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_directory, ignore_errors=True)
+    os.makedirs(metrics_directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Build the index before the worker accepts requests instead of
+    # letting its first requests race to build it.
+    from db.base_model import db
+    from product_index import product_index
+    with db.connection_context():
+        product_index.build()
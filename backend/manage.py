@@ -1,9 +1,14 @@
 import os
 import sys
 
+from catalog_export import CatalogExport
+from catalog_version import CatalogVersion
 from db.base_model import db
-from product import Product, Tag, TagXProduct, Color, ColorXProduct
-from scraper import Scraper
+from playhouse.migrate import SqliteMigrator, migrate
+from product import (Product, ProductSearch, Tag, TagXProduct, Color,
+                     ColorXProduct)
+from searches import MaterializedSearch, MaterializedSearchProduct
+from static_files import StaticFiles
 from temp_directory import TempDirectory
 
 TAGS: list[str] = [
@@ -11,13 +16,23 @@ TAGS: list[str] = [
 ]
 DB_FILENAME: str = "backend/db/db.sqlite3"
 PLOTS_DIRECTORY: str = "backend/static/product_plots"
+CATALOG_FILENAME: str = "backend/catalog.fwcat"
+INDEXED_PRODUCT_FIELDS: list[str] = [
+    'shot_count', 'nem_per_second', 'nem_per_shot', 'shots_per_second',
+    'price_per_shot', 'price_per_second', 'price_per_nem', 'updated_at',
+    'rated', 'catalog_version'
+]
 
 
 def db_create():
     db.connect()
-    db.create_tables([Product, Tag, TagXProduct, Color, ColorXProduct])
+    db.create_tables([
+        Product, ProductSearch, Tag, TagXProduct, Color, ColorXProduct,
+        MaterializedSearch, MaterializedSearchProduct
+    ])
     for tag in TAGS:
         Tag.create(name=tag)
+    CatalogVersion.create_state()
     db.close()
 
 
@@ -33,6 +48,37 @@ def db_recreate():
     db_create()
 
 
+def db_migrate():
+    db.connect()
+    migrator = SqliteMigrator(db)
+    columns = [column.name for column in db.get_columns('product')]
+    with db.atomic():
+        migrate(*[
+            migrator.add_column('product', name, getattr(Product, name))
+            for name in INDEXED_PRODUCT_FIELDS
+            if name not in columns
+        ])
+        indexes = [index.name for index in db.get_indexes('product')]
+        migrate(*[
+            migrator.add_index('product', (name,), False)
+            for name in INDEXED_PRODUCT_FIELDS
+            if f"product_{name}" not in indexes
+        ])
+        products = list(Product.select())
+        for product in products:
+            product.compute_derived_fields()
+        Product.bulk_update(
+            products,
+            [getattr(Product, name) for name in Product.DERIVED_FIELDS],
+            batch_size=100
+        )
+        ProductSearch.create_table()
+        ProductSearch.rebuild()
+        db.create_tables([MaterializedSearch, MaterializedSearchProduct])
+        CatalogVersion.create_state()
+    db.close()
+
+
 def del_plots():
     for filename in os.listdir(PLOTS_DIRECTORY):
         full_filename = os.path.join(
@@ -48,6 +94,12 @@ def create_plots():
         p.create_plots()
 
 
+def compress_plots():
+    for filename in os.listdir(PLOTS_DIRECTORY):
+        if StaticFiles.is_compressible(filename):
+            StaticFiles.compress(os.path.join(PLOTS_DIRECTORY, filename))
+
+
 def download_videos():
     temp_directory = TempDirectory().directory
     product_count = len(Product.select())
@@ -56,7 +108,16 @@ def download_videos():
         product.download_video(temp_directory)
 
 
+def export_catalog():
+    filename = sys.argv[2] if len(sys.argv) > 2 else CATALOG_FILENAME
+    CatalogExport.export(filename)
+    print(f"Exported catalog to {filename}")
+
+
 def scrape():
+    # Imported on demand so that the other commands do not load the
+    # HTTP and HTML parsing stack.
+    from scraper import Scraper
     scraper = Scraper()
     scraper.scrape()
 
@@ -75,8 +136,14 @@ def main():
         create_plots()
     elif arg == 'db_recreate':
         db_recreate()
+    elif arg == 'db_migrate':
+        db_migrate()
     elif arg == 'download_videos':
         download_videos()
+    elif arg == 'export_catalog':
+        export_catalog()
+    elif arg == 'compress_plots':
+        compress_plots()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+from __future__ import annotations
+import base64
+import json
+import numpy as np
+from product_index import ProductIndex
+
+
+class Paginator:
+
+    MAX_LIMIT: int = 1000
+
+    _index: ProductIndex
+    _sort_field: str
+    _descending: bool
+    _limit: int
+    _cursor: tuple[bool, float, str]
+    next_cursor: str
+
+    def __init__(
+        self, index: ProductIndex, sort_field: str = None,
+        descending: bool = False, limit: int = None, cursor: str = None
+    ):
+        if sort_field is not None and sort_field not in index.NUMBER_FIELDS:
+            raise ValueError(f"Invalid sort field: {sort_field}")
+        self._index = index
+        self._sort_field = sort_field
+        self._descending = descending
+        self._limit = (
+            None if limit is None else max(1, min(limit, self.MAX_LIMIT))
+        )
+        self._cursor = None if cursor is None else self.decode_cursor(cursor)
+        self.next_cursor = None
+
+    @classmethod
+    def from_args(cls, index: ProductIndex, args: dict) -> Paginator:
+        limit = args.get('limit')
+        return cls(
+            index,
+            args.get('sort'),
+            args.get('order', 'asc') == 'desc',
+            None if limit is None else int(limit),
+            args.get('cursor')
+        )
+
+    @staticmethod
+    def encode_cursor(cursor: tuple[bool, float, str]) -> str:
+        return base64.urlsafe_b64encode(
+            json.dumps(cursor).encode()
+        ).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple[bool, float, str]:
+        try:
+            is_null, value, id_ = json.loads(base64.urlsafe_b64decode(cursor))
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return bool(is_null), float(value), str(id_)
+
+    def _sort_keys(
+        self, ordinals: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ids = self._index.id_array()[ordinals]
+        if self._sort_field is None:
+            nulls = np.zeros(len(ordinals), dtype=np.bool_)
+            values = np.zeros(len(ordinals), dtype=np.float64)
+        else:
+            values, nulls = self._index.column(self._sort_field)
+            values = np.where(nulls[ordinals], 0, values[ordinals])
+            nulls = nulls[ordinals]
+            if self._descending:
+                values = -values
+        return nulls, values, ids
+
+    def page(self, ids: list[str]) -> list[str]:
+        ordinals = self._index.ordinals(ids)
+        nulls, values, sort_ids = self._sort_keys(ordinals)
+
+        if self._cursor is not None:
+            cursor_null, cursor_value, cursor_id = self._cursor
+            after = (
+                (nulls > cursor_null)
+                | ((nulls == cursor_null) & (values > cursor_value))
+                | (
+                    (nulls == cursor_null) & (values == cursor_value)
+                    & (sort_ids > cursor_id)
+                )
+            )
+            ordinals, nulls = ordinals[after], nulls[after]
+            values, sort_ids = values[after], sort_ids[after]
+
+        order = np.lexsort((sort_ids, values, nulls))
+        if self._limit is not None and len(order) > self._limit:
+            order = order[:self._limit]
+            last = order[-1]
+            self.next_cursor = self.encode_cursor((
+                bool(nulls[last]), float(values[last]), str(sort_ids[last])
+            ))
+        return self._index.ids_for(ordinals[order])
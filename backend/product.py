@@ -1,195 +1,97 @@
-import os
+from __future__ import annotations
+import hashlib
 import re
+from datetime import datetime
 from string import digits
-from typing import Iterator
 
-import ffmpeg
-import matplotlib.pyplot as plt
-import numpy as np
-from db.base_model import BaseModel
-from peewee import (BooleanField, DoesNotExist, ForeignKeyField, IntegerField,
-                    TextField)
-from playhouse.hybrid import hybrid_property
-from pytube import YouTube
-
-
-class ProductVideoMixin:
-
-    YOUTUBE_LINK_PREFIX: str = "https://www.youtube.com/watch?v="
-    OUTPUT_DIRECTORY: str = "backend/static/videos"
-
-    def download_video(self, temp_directory: str):
-        if self.youtube_handle is None or self.youtube_handle == "":
-            return
-        output_filename = os.path.join(
-            self.OUTPUT_DIRECTORY, f"{self.id_}.mp4"
-        )
-        if os.path.exists(output_filename):
-            return
-        youtube = YouTube(
-            f"{self.YOUTUBE_LINK_PREFIX}{self.youtube_handle}"
-        )
-        video_stream = (
-            youtube.streams.filter(mime_type='video/mp4')
-            .order_by('resolution')
-            .desc()
-            .first()
-        )
-        audio_stream = (
-            youtube.streams.filter(mime_type='audio/mp4')
-            .order_by('bitrate')
-            .desc()
-            .first()
-        )
-        video_stream.download(temp_directory, filename=f"{self.id_}.mp4")
-        audio_stream.download(temp_directory, filename=f"{self.id_}.mp3")
-        video_data = ffmpeg.input(
-            os.path.join(temp_directory, f"{self.id_}.mp4")
-        )
-        audio_data = ffmpeg.input(
-            os.path.join(temp_directory, f"{self.id_}.mp3")
-        )
-        ffmpeg.output(
-            video_data,
-            audio_data,
-            output_filename,
-            vcodec='copy',
-            acodec='aac'
-        ).run()
-        os.remove(os.path.join(temp_directory, f"{self.id_}.mp4"))
-        os.remove(os.path.join(temp_directory, f"{self.id_}.mp3"))
-
-
-class ProductPlottingMixin:
-
-    PLOTS_DIRECTORY: str = "backend/static/product_plots"
-    LIGHTGREEN = '#90EE90'
-    LIGHTRED = '#FFC0CB'
-    LIGHTGRAY = '#D3D3D3'
-    if not os.path.exists(PLOTS_DIRECTORY):
-        os.makedirs(PLOTS_DIRECTORY)
-
-    COLOR_MODE: dict[str, str] = {
-        'price': 'low',
-        'weight': 'high',
-        'min_caliber': 'neutral',
-        'max_caliber': 'neutral',
-        'min_height': 'neutral',
-        'max_height': 'neutral',
-        'shot_count': 'high',
-        'duration': 'high',
-        'nem': 'high',
-        'nem_per_second': 'high',
-        'nem_per_shot': 'high',
-        'shots_per_second': 'high',
-        'price_per_shot': 'low',
-        'price_per_second': 'low',
-        'price_per_nem': 'low'
-    }
-
-    IS_PROPERTY: dict[str, bool] = {
-        'price': False,
-        'weight': False,
-        'min_caliber': False,
-        'max_caliber': False,
-        'min_height': False,
-        'max_height': False,
-        'shot_count': True,
-        'duration': False,
-        'nem': False,
-        'nem_per_second': True,
-        'nem_per_shot': True,
-        'shots_per_second': True,
-        'price_per_shot': True,
-        'price_per_second': True,
-        'price_per_nem': True
-    }
-
-    def _property_values(self, field_name: str) -> Iterator[any]:
-        for product in Product.select():
-            try:
-                value = getattr(product, field_name)
-                if value is not None:
-                    yield value
-            except TypeError:
-                pass
-
-    def _get_values(self, field_name: str) -> np.ndarray:
-        values = np.array(
-            list(self._property_values(field_name))
-            if self.IS_PROPERTY[field_name]
-            else [
-                getattr(p, field_name) for p in
-                Product.select()
-                .where(getattr(Product, field_name).is_null(False))
-            ]
-        )
-        return values
-
-    def _create_plot(self, field_name: str) -> str:
-        values = self._get_values(field_name)
-
-        fig, ax = plt.subplots()
-        fig.set_figwidth(10)
-        fig.set_figheight(1)
-
-        boxplot = ax.boxplot(
-            x=values, vert=False, whis=[5, 95], notch=True,
-            medianprops={'color': 'black'}, patch_artist=True,
-            showfliers=False,
-            widths=[0.99]
-        )
-
-        median = boxplot['medians'][0].get_xdata()[0]
-        if (value := getattr(self, field_name)) is None:
-            box_color = self.LIGHTGRAY
-        elif self.COLOR_MODE[field_name] == 'low':
-            box_color = self.LIGHTGREEN if value < median else self.LIGHTRED
-        elif self.COLOR_MODE[field_name] == 'high':
-            box_color = self.LIGHTGREEN if value > median else self.LIGHTRED
-        else:
-            box_color = self.LIGHTGRAY
-
-        boxplot['boxes'][0].set_facecolor(box_color)
-        try:
-            ax.axvline(
-                value, 0, 1000, color='black',
-                linewidth=3
-            )
-        except TypeError:
-            return
-        ax.legend_ = None
-        for pos in ('top', 'right', 'bottom', 'left'):
-            ax.spines[pos].set_visible(False)
-        ax.get_xaxis().set_ticks([])
-        ax.get_yaxis().set_ticks([])
-        filename = os.path.join(
-            self.PLOTS_DIRECTORY,
-            f"{self.id_}_{field_name}.svg"
-        )
-        fig.savefig(filename)
-        plt.close(fig)
-        return filename
-
-    def create_plots(self) -> dict[str, str]:
-        return {
-            field_name: self._create_plot(field_name)
-            for field_name in self.COLOR_MODE
-        }
+from catalog_version import CatalogVersion
+from db.base_model import BaseModel, db
+from peewee import (SQL, BooleanField, Field, FloatField, ForeignKeyField,
+                    IntegerField, Query, TextField)
+from playhouse.sqlite_ext import FTS5Model, SearchField
+from product_plotting import ProductPlottingMixin
+from product_video import ProductVideoMixin
+from snapshot_cache import snapshot_cache
 
 
 class ProductSerializeMixin:
 
-    def to_dict(self) -> dict[str, any]:
+    SERIALIZATION_CHUNK_SIZE: int = 500
+    SERIALIZED_FIELDS: list[str] = [
+        'id_', 'url', 'name', 'article_number', 'price', 'youtube_handle',
+        'weight', 'min_caliber', 'max_caliber', 'min_height', 'max_height',
+        'shot_count', 'duration', 'fan', 'nem', 'availability', 'is_new',
+        'rating', 'rated', 'tags', 'colors', 'nem_per_second', 'nem_per_shot',
+        'shots_per_second', 'price_per_shot', 'price_per_second',
+        'price_per_nem', 'short_name', 'package_size'
+    ]
+    RELATION_FIELDS: list[str] = ['tags', 'colors']
+
+    @classmethod
+    def parse_fields(cls, fields: str) -> list[str]:
+        if fields is None:
+            return None
+        fields = [field.strip() for field in fields.split(',') if field]
+        for field in fields:
+            if field not in cls.SERIALIZED_FIELDS:
+                raise ValueError(f"Invalid field: {field}")
+        return fields
+
+    @classmethod
+    def select_columns(cls, fields: list[str] = None) -> list[Field]:
+        if fields is None:
+            return []
+        return [cls.id_] + [
+            getattr(cls, field) for field in fields
+            if field not in cls.RELATION_FIELDS and field != 'id_'
+        ]
+
+    @staticmethod
+    def _names_by_product(
+        table: BaseModel, x_table: BaseModel, ids: list[str]
+    ) -> dict[str, list[str]]:
+        names = {}
+        for i in range(
+            0, len(ids), ProductSerializeMixin.SERIALIZATION_CHUNK_SIZE
+        ):
+            chunk = ids[i:i + ProductSerializeMixin.SERIALIZATION_CHUNK_SIZE]
+            for id_, name in (
+                x_table.select(x_table.product, table.name)
+                .join(table)
+                .where(x_table.product.in_(chunk))
+                .tuples()
+            ):
+                names.setdefault(id_, []).append(name)
+        return names
+
+    @classmethod
+    def to_dicts(
+        cls, products: list[Product], fields: list[str] = None
+    ) -> list[dict[str, any]]:
+        products = list(products)
+        ids = [product.id_ for product in products]
         tags = (
-            Tag.select().join(TagXProduct).join(Product)
-            .where(Product.id_ == self.id_)
+            cls._names_by_product(Tag, TagXProduct, ids)
+            if fields is None or 'tags' in fields else {}
         )
         colors = (
-            Color.select().join(ColorXProduct).join(Product)
-            .where(Product.id_ == self.id_)
+            cls._names_by_product(Color, ColorXProduct, ids)
+            if fields is None or 'colors' in fields else {}
         )
-        return {
+        return [
+            product._serialize(
+                tags.get(product.id_, []), colors.get(product.id_, []), fields
+            )
+            for product in products
+        ]
+
+    def to_dict(self, fields: list[str] = None) -> dict[str, any]:
+        return self.to_dicts([self], fields)[0]
+
+    def _serialize(
+        self, tags: list[str], colors: list[str], fields: list[str]
+    ) -> dict[str, any]:
+        values = {
             'id_': self.id_,
             'url': self.url,
             'name': self.name,
@@ -209,8 +111,8 @@ class ProductSerializeMixin:
             'is_new': self.is_new,
             'rating': self.rating,
             'rated': self.rated,
-            'tags': [t.name for t in tags],
-            'colors': [c.name for c in colors],
+            'tags': tags,
+            'colors': colors,
             'nem_per_second': self.nem_per_second,
             'nem_per_shot': self.nem_per_shot,
             'shots_per_second': self.shots_per_second,
@@ -220,36 +122,60 @@ class ProductSerializeMixin:
             'short_name': self.short_name,
             'package_size': self.package_size
         }
+        if fields is None:
+            return values
+        return {field: values[field] for field in fields}
 
     def _update_tags(self, tags: list[str]):
-        my_tags = (
-            Tag.select().join(TagXProduct).join(Product)
-            .where(Product.id_ == self.id_)
-        )
-        for tag_str in tags:
-            try:
-                tag = Tag.get(Tag.name == tag_str)
-            except DoesNotExist:
-                tag = Tag.create(name=tag_str)
-                TagXProduct.create(tag=tag, product=self)
-                continue
-
-            if tag not in my_tags:
-                TagXProduct.create(tag=tag, product=self)
-
-        for tag in my_tags:
-            if tag.name in tags:
-                continue
-            tag_x_product = TagXProduct.get(
-                TagXProduct.tag == tag,
-                TagXProduct.product == self
-            )
-            tag_x_product.delete_instance()
+        current = {
+            name: id_ for id_, name in
+            TagXProduct.select(TagXProduct.id_, Tag.name)
+            .join(Tag)
+            .where(TagXProduct.product == self.id_)
+            .tuples()
+        }
+        added = set(tags) - current.keys()
+        removed = current.keys() - set(tags)
+        if not added and not removed:
+            return
+
+        if added:
+            existing = {
+                tag.name: tag for tag in
+                Tag.select().where(Tag.name.in_(list(added)))
+            }
+            TagXProduct.insert_many([
+                {
+                    'tag': existing.get(name) or Tag.create(name=name),
+                    'product': self.id_
+                }
+                for name in sorted(added)
+            ]).execute()
+        if removed:
+            TagXProduct.delete().where(TagXProduct.id_.in_(
+                [current[name] for name in removed]
+            )).execute()
+
+        snapshot_cache.invalidate(self.id_)
+        # Tag edits count as product changes for delta sync.
+        self.updated_at = datetime.now()
+        Product.update(updated_at=self.updated_at).where(
+            Product.id_ == self.id_
+        ).execute()
 
     def update_field(self, key: str, value: any):
         if key == 'tags':
             self._update_tags(value)
         elif hasattr(self, key):
+            # peewee passes unparsable numbers through to SQLite as text.
+            if (
+                isinstance(
+                    self._meta.fields.get(key), (IntegerField, FloatField)
+                )
+                and value is not None
+                and not isinstance(value, (int, float))
+            ):
+                raise ValueError(f"Invalid value for {key}: {value!r}")
             setattr(self, key, value)
         else:
             raise KeyError(f"Invalid Key: {key}")
@@ -289,75 +215,93 @@ class ProductPropertyMixin:
             return f"{BASE_URL}/404"
         return f"{BASE_URL}/watch?v={self.youtube_handle}"
 
-    @hybrid_property
-    def nem_per_second(self) -> float:
+    def _shot_count(self) -> int:
+        p_size = self.package_size
+        if p_size == 1:
+            return self.raw_shot_count
+        if (
+            (self.raw_shot_count or p_size) < p_size
+            or (self.raw_shot_count or p_size) % p_size != 0
+            or (
+                not self.shot_count_has_multiplier
+                and self.raw_shot_count is not None
+            )
+        ):
+            return self.raw_shot_count * self.package_size
+        return self.raw_shot_count
+
+    def _nem_per_second(self) -> float:
         try:
             return (
                 0.001 * self.nem / self.duration / self.package_size
             )
-        except TypeError:
+        except (TypeError, ZeroDivisionError):
             return None
 
-    @hybrid_property
-    def nem_per_shot(self) -> float:
+    def _nem_per_shot(self) -> float:
         try:
             return (0.001 * self.nem / self.shot_count)
-        except TypeError:
+        except (TypeError, ZeroDivisionError):
             return None
 
-    @hybrid_property
-    def shots_per_second(self) -> float:
+    def _shots_per_second(self) -> float:
         try:
             return (self.shot_count / self.duration)
-        except TypeError:
+        except (TypeError, ZeroDivisionError):
             return None
 
-    @hybrid_property
-    def price_per_shot(self) -> float:
+    def _price_per_shot(self) -> float:
         try:
             return (0.01 * self.price / self.shot_count)
-        except TypeError:
+        except (TypeError, ZeroDivisionError):
             return None
 
-    @hybrid_property
-    def price_per_second(self) -> float:
+    def _price_per_second(self) -> float:
         try:
             return (0.01 * self.price / self.duration)
-        except TypeError:
+        except (TypeError, ZeroDivisionError):
             return None
 
-    @hybrid_property
-    def price_per_nem(self) -> float:
+    def _price_per_nem(self) -> float:
         try:
             return (10 * self.price / self.nem)
-        except TypeError:
+        except (TypeError, ZeroDivisionError):
             return None
 
-    @hybrid_property
-    def shot_count(self) -> int:
-        p_size = self.package_size
-        if p_size == 1:
-            return self.raw_shot_count
-        if (
-            (self.raw_shot_count or p_size) < p_size
-            or (self.raw_shot_count or p_size) % p_size != 0
-            or (
-                not self.shot_count_has_multiplier
-                and self.raw_shot_count is not None
-            )
-        ):
-            return self.raw_shot_count * self.package_size
-        return self.raw_shot_count
+    def compute_derived_fields(self):
+        self.short_name = self._short_name()
+        self.package_size = self._package_size()
+        self.shot_count = self._shot_count()
+        self.nem_per_second = self._nem_per_second()
+        self.nem_per_shot = self._nem_per_shot()
+        self.shots_per_second = self._shots_per_second()
+        self.price_per_shot = self._price_per_shot()
+        self.price_per_second = self._price_per_second()
+        self.price_per_nem = self._price_per_nem()
 
 
 class Product(
     BaseModel, ProductPlottingMixin,
     ProductSerializeMixin, ProductPropertyMixin, ProductVideoMixin
 ):
+    class Meta:
+        indexes = ((('updated_at',), False),)
+
+    DERIVED_FIELDS: list[str] = [
+        'short_name', 'package_size', 'shot_count', 'nem_per_second',
+        'nem_per_shot', 'shots_per_second', 'price_per_shot',
+        'price_per_second', 'price_per_nem'
+    ]
+
     def save(self, *args, **kwargs):
-        self.short_name = self._short_name()
-        self.package_size = self._package_size()
-        super().save(*args, **kwargs)
+        self.compute_derived_fields()
+        with db.atomic():
+            # Stamped in the same transaction as the row, so other
+            # processes can fetch exactly the rows they have not seen.
+            self.catalog_version = CatalogVersion.bump()
+            super().save(*args, **kwargs)
+            ProductSearch.index_product(self)
+        snapshot_cache.invalidate(self.id_)
 
     url = TextField(unique=True)
     name = TextField()
@@ -379,8 +323,17 @@ class Product(
     is_new = BooleanField(default=False)
     package_size = IntegerField()
 
+    shot_count = IntegerField(null=True, index=True)
+    nem_per_second = FloatField(null=True, index=True)
+    nem_per_shot = FloatField(null=True, index=True)
+    shots_per_second = FloatField(null=True, index=True)
+    price_per_shot = FloatField(null=True, index=True)
+    price_per_second = FloatField(null=True, index=True)
+    price_per_nem = FloatField(null=True, index=True)
+
     rating = BooleanField(default=None, null=True)
-    rated = BooleanField(default=False)
+    rated = BooleanField(default=False, index=True)
+    catalog_version = IntegerField(null=True, index=True)
 
 
 class Tag(BaseModel):
@@ -399,3 +352,62 @@ class Color(BaseModel):
 class ColorXProduct(BaseModel):
     color = ForeignKeyField(Color, backref='color_x_product')
     product = ForeignKeyField(Product, backref='color_x_product')
+
+
+class ProductSearch(FTS5Model):
+    class Meta:
+        database = db
+        table_name = 'product_search'
+        options = {'tokenize': 'trigram'}
+
+    TRIGRAM_LENGTH: int = 3
+    DEFAULT_SUGGESTION_LIMIT: int = 10
+    MAX_SUGGESTION_LIMIT: int = 50
+
+    product_id = SearchField(unindexed=True)
+    short_name = SearchField()
+    article_number = SearchField()
+
+    @staticmethod
+    def rowid_for(product_id: str) -> int:
+        return int(hashlib.blake2b(
+            str(product_id).encode(), digest_size=7
+        ).hexdigest(), 16)
+
+    @classmethod
+    def index_product(cls, product: Product):
+        cls.replace(
+            rowid=cls.rowid_for(product.id_),
+            product_id=product.id_,
+            short_name=product.short_name,
+            article_number=product.article_number
+        ).execute()
+
+    @classmethod
+    def rebuild(cls):
+        cls.delete().execute()
+        for product in Product.select().iterator():
+            cls.index_product(product)
+
+    @classmethod
+    def phrase(cls, column_name: str, value: str) -> str:
+        escaped_value = value.replace('"', '""')
+        return f'{column_name}: "{escaped_value}"'
+
+    @classmethod
+    def suggest(
+        cls, prefix: str, limit: int = DEFAULT_SUGGESTION_LIMIT
+    ) -> Query:
+        name_starts = (
+            cls.select(cls.product_id, cls.short_name)
+            .where(cls.short_name.ilike(f"{prefix}%"))
+        )
+        word_starts = (
+            cls.select(cls.product_id, cls.short_name)
+            .where(cls.short_name.ilike(f"% {prefix}%"))
+        )
+        return (
+            (name_starts | word_starts)
+            .order_by(SQL('short_name'))
+            .limit(max(1, min(limit, cls.MAX_SUGGESTION_LIMIT)))
+        )
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import numpy as np
+from catalog_version import CatalogVersion
+from db.base_model import BaseModel
+from product import Color, ColorXProduct, Tag, TagXProduct
+from product_index import ProductIndex
+from product_statistics import ProductStatistics
+
+
+class ProductFacets:
+
+    BOOLEAN_FIELDS: list[str] = [
+        "is_new", "rated", "fan", "availability", "rating"
+    ]
+    NUMBER_FIELDS: list[str] = [
+        "price", "weight", "min_caliber", "max_caliber", "min_height",
+        "max_height", "duration", "nem",
+        "package_size", "nem_per_second", "nem_per_shot", "shots_per_second",
+        "price_per_shot", "price_per_second", "price_per_nem", "shot_count"
+    ]
+    COLUMN_DIVISORS: dict[str, int] = {
+        "price": 100,
+        "weight": 1000,
+        "nem": 1000,
+    }
+    RELATIONS: dict[str, tuple[BaseModel, BaseModel]] = {
+        'tags': (Tag, TagXProduct),
+        'colors': (Color, ColorXProduct)
+    }
+
+    _relations: dict[str, tuple[np.ndarray, np.ndarray, list[str]]] = None
+    _relations_version: int = None
+
+    @classmethod
+    def _relation_columns(
+        cls, index: ProductIndex
+    ) -> dict[str, tuple[np.ndarray, np.ndarray, list[str]]]:
+        version = CatalogVersion.get()
+        if cls._relations is None or cls._relations_version != version:
+            relations = {}
+            for facet_name, (table, x_table) in cls.RELATIONS.items():
+                pairs = [
+                    (id_, name) for id_, name in
+                    x_table.select(x_table.product, table.name)
+                    .join(table)
+                    .tuples()
+                    if index.contains(id_)
+                ]
+                names = sorted({name for _, name in pairs})
+                codes = {name: code for code, name in enumerate(names)}
+                ordinals = index.ordinals([id_ for id_, _ in pairs])
+                relations[facet_name] = (
+                    ordinals,
+                    np.array(
+                        [codes[name] for _, name in pairs], dtype=np.int64
+                    ),
+                    names
+                )
+            cls._relations = relations
+            cls._relations_version = version
+        return cls._relations
+
+    @classmethod
+    def compute(cls, index: ProductIndex, ids: list[str]) -> dict[str, any]:
+        statistics = ProductStatistics.current(index)
+        selected = index.empty_mask()
+        selected[index.ordinals(ids)] = True
+
+        facets = {'count': int(selected.sum())}
+
+        for facet_name, (ordinals, codes, names) in (
+            cls._relation_columns(index).items()
+        ):
+            counts = np.bincount(
+                codes[selected[ordinals]], minlength=len(names)
+            )
+            facets[facet_name] = {
+                name: int(count)
+                for name, count in zip(names, counts) if count
+            }
+
+        facets['booleans'] = {}
+        for field_name in cls.BOOLEAN_FIELDS:
+            values, nulls = index.column(field_name)
+            values, nulls = values[selected], nulls[selected]
+            facets['booleans'][field_name] = {
+                'true': int((values & ~nulls).sum()),
+                'false': int((~values & ~nulls).sum()),
+                'null': int(nulls.sum())
+            }
+
+        facets['numbers'] = {}
+        for field_name in cls.NUMBER_FIELDS:
+            values, nulls = index.column(field_name)
+            values, nulls = values[selected], nulls[selected]
+            divisor = cls.COLUMN_DIVISORS.get(field_name, 1)
+            edges = statistics.histogram_edges(field_name)
+            counts = (
+                np.histogram(values[~nulls], bins=edges)[0]
+                if edges is not None else np.zeros(0, dtype=np.int64)
+            )
+            facets['numbers'][field_name] = {
+                'edges': (
+                    [] if edges is None
+                    else [float(edge) / divisor for edge in edges]
+                ),
+                'counts': [int(count) for count in counts],
+                'null': int(nulls.sum())
+            }
+
+        return facets
@@ -1,6 +1,21 @@
 from __future__ import annotations
-from product import Product, Color, ColorXProduct, Tag, TagXProduct
-from peewee import DoesNotExist
+import hashlib
+import json
+import operator
+import sys
+import time
+from typing import Callable
+import numpy as np
+from bitmap import Bitmap
+from catalog_version import CatalogVersion
+from filter_cache import FilterCache
+from product import (Product, ProductSearch, Color, ColorXProduct, Tag,
+                     TagXProduct)
+from product_index import ProductIndex, product_index
+from product_statistics import ProductStatistics
+from query_planner import (AndPlanNode, FilterPlanNode, NotPlanNode,
+                           OrPlanNode, PlanMemo, PlanNode, PlanProfile)
+from peewee import Expression, fn, query_to_string
 from abc import ABC, abstractmethod
 from db.base_model import BaseModel
 
@@ -20,6 +35,10 @@ class OperatorToken(Token):
     def __init__(self, operator: str):
         self._operator = operator
 
+    @property
+    def operator(self) -> str:
+        return self._operator
+
     def __lt__(self, other: OperatorToken) -> bool:
         if isinstance(other, ParenthesisToken):
             return False
@@ -36,6 +55,9 @@ class OperatorToken(Token):
             return False
         return self._operator == other._operator
 
+    def __str__(self) -> str:
+        return self._operator.upper()
+
 
 class ParenthesisToken(Token):
 
@@ -56,6 +78,9 @@ class ParenthesisToken(Token):
     def is_close(self) -> bool:
         return self._parenthesis == self.CLOSE
 
+    def __str__(self) -> str:
+        return self._parenthesis
+
 
 class FilterToken(Token):
 
@@ -67,9 +92,16 @@ class FilterToken(Token):
     def __invert__(self) -> ProductFilter:
         return self.__class__(~self.filter_)
 
+    def __str__(self) -> str:
+        return self.filter_.describe()
+
 
 class ProductFilter(ABC):
 
+    COST: float = 10.0
+    INDEXED: bool = False
+    CANDIDATE_LIMIT: int = 500
+
     _value: any
     _operation: str
     _inverted: bool
@@ -86,13 +118,56 @@ class ProductFilter(ABC):
     def __invert__(self) -> ProductFilter:
         return self.__class__(self._value, self._operation, not self._inverted)
 
+    def key(self) -> tuple:
+        return (
+            self.__class__.__name__, self._column_name, self._operation,
+            self._value, bool(self._inverted)
+        )
+
+    def describe(self) -> str:
+        return (
+            f"{'NOT ' if self._inverted else ''}{self.__class__.__name__}"
+            f"({self._column_name} {self._operation} {self._value!r})"
+        )
+
+    @abstractmethod
+    def selectivity(self, statistics: ProductStatistics) -> float:
+        pass
+
     @abstractmethod
-    def run(self) -> set[Product]:
+    def expression(self) -> Expression:
         pass
 
+    def mask(
+        self, index: ProductIndex, candidates: Bitmap = None,
+        record_sql: Callable[[str], None] = None
+    ) -> np.ndarray:
+        query = Product.select(Product.id_).where(self.expression())
+        if (
+            candidates is not None
+            and len(candidates) <= self.CANDIDATE_LIMIT
+        ):
+            query = query.where(Product.id_.in_(index.ids(candidates)))
+        if record_sql is not None:
+            record_sql(query_to_string(query))
+        return index.mask_from_query(query)
+
+    def bitmap(
+        self, index: ProductIndex, candidates: Bitmap = None,
+        record_sql: Callable[[str], None] = None
+    ) -> Bitmap:
+        return Bitmap.from_mask(self.mask(index, candidates, record_sql))
+
 
 class TextFilter(ProductFilter):
 
+    SELECTIVITIES: dict[str, float] = {
+        'is': 0.01,
+        'startswith': 0.05,
+        'endswith': 0.05,
+        'contains': 0.1
+    }
+
     _show_null: bool
     _case_sensitive: bool
 
@@ -106,41 +181,89 @@ class TextFilter(ProductFilter):
         if not self._case_sensitive:
             self._value = self._value.lower()
 
-    def run(self) -> set[Product]:
-        attribute = getattr(Product, self._column_name)
-        wildcard = '*' if self._case_sensitive else '%'
+    def key(self) -> tuple:
+        return super().key() + (
+            bool(self._show_null), bool(self._case_sensitive)
+        )
 
-        if self._operation == 'is':
-            products = Product.select().where(
-                (
-                    attribute == self._value
-                    if self._case_sensitive
-                    else attribute.ilike(self._value)
-                ) != self._inverted
+    def selectivity(self, statistics: ProductStatistics) -> float:
+        selectivity = self.SELECTIVITIES.get(self._operation, 1.0)
+        return 1 - selectivity if self._inverted else selectivity
+
+    def _pattern(self) -> str:
+        if self._case_sensitive:
+            wildcard = '*'
+            value = "".join(
+                f"[{c}]" if c in '*?[' else c for c in self._value
             )
+        else:
+            wildcard = '%'
+            value = self._value
+        if self._operation == 'is':
+            return value
         elif self._operation == 'startswith':
-            products = Product.select().where(
-                attribute.ilike(f"{self._value}{wildcard}") != self._inverted
-            )
+            return f"{value}{wildcard}"
         elif self._operation == 'endswith':
-            products = Product.select().where(
-                attribute.ilike(f"{wildcard}{self._value}") != self._inverted
-            )
+            return f"{wildcard}{value}"
         elif self._operation == 'contains':
-            products = Product.select().where(
-                attribute.ilike(
-                    f"{wildcard}{self._value}{wildcard}"
-                ) != self._inverted
+            return f"{wildcard}{value}{wildcard}"
+
+    def _search_ids(self, expression: Expression) -> Expression:
+        return Product.id_.in_(
+            ProductSearch.select(ProductSearch.product_id).where(expression)
+        )
+
+    def expression(self) -> Expression:
+        attribute = getattr(Product, self._column_name)
+
+        if not self._case_sensitive:
+            expression = self._search_ids(
+                getattr(ProductSearch, self._column_name).ilike(
+                    self._pattern()
+                )
             )
+        else:
+            expression = (
+                attribute == self._value
+                if self._operation == 'is'
+                else fn.GLOB(self._pattern(), attribute)
+            )
+            if len(self._value) >= ProductSearch.TRIGRAM_LENGTH:
+                expression = self._search_ids(ProductSearch.match(
+                    ProductSearch.phrase(self._column_name, self._value)
+                )) & expression
+
+        if self._inverted:
+            expression = ~expression
 
         if self._show_null:
-            products = products | Product.select().where(attribute.is_null())
+            expression = expression | attribute.is_null()
 
-        return set([product for product in products])
+        return expression
 
 
 class NumberFilter(ProductFilter):
 
+    COST: float = 1.0
+    INDEXED: bool = True
+
+    OPERATIONS: dict[str, Callable] = {
+        '==': operator.eq,
+        '!=': operator.ne,
+        '<': operator.lt,
+        '<=': operator.le,
+        '>': operator.gt,
+        '>=': operator.ge
+    }
+    INVERTED_OPERATIONS: dict[str, str] = {
+        '==': '!=',
+        '!=': '==',
+        '<': '>=',
+        '<=': '>',
+        '>': '<=',
+        '>=': '<'
+    }
+
     _show_null: bool
 
     def __init__(
@@ -150,42 +273,75 @@ class NumberFilter(ProductFilter):
         self._show_null = show_null
         super().__init__(float(value), operation, inverted, column_name)
 
-    def run(self) -> set[Product]:
-        attribute = getattr(Product, self._column_name)
+    def key(self) -> tuple:
+        operation = (
+            self.INVERTED_OPERATIONS[self._operation]
+            if self._inverted
+            else self._operation
+        )
+        return (
+            self.__class__.__name__, self._column_name, operation,
+            self._value, bool(self._show_null)
+        )
 
-        if self._operation == '==':
-            products = Product.select().where(
-                (attribute == self._value) != self._inverted
-            )
-        elif self._operation == '!=':
-            products = Product.select().where(
-                (attribute != self._value) != self._inverted
-            )
-        elif self._operation == '<':
-            products = Product.select().where(
-                (attribute < self._value) != self._inverted
-            )
-        elif self._operation == '<=':
-            products = Product.select().where(
-                (attribute <= self._value) != self._inverted
-            )
-        elif self._operation == '>':
-            products = Product.select().where(
-                (attribute > self._value) != self._inverted
-            )
-        elif self._operation == '>=':
-            products = Product.select().where(
-                (attribute >= self._value) != self._inverted
+    def selectivity(self, statistics: ProductStatistics) -> float:
+        operation = (
+            self.INVERTED_OPERATIONS[self._operation]
+            if self._inverted
+            else self._operation
+        )
+        if operation in ('==', '!='):
+            fraction = statistics.equal_fraction(self._column_name)
+        else:
+            fraction = statistics.below_fraction(
+                self._column_name, self._value
             )
+        if operation in ('!=', '>', '>='):
+            fraction = 1 - fraction
+        null_fraction = statistics.null_fraction(self._column_name)
+        return (
+            (1 - null_fraction) * fraction
+            + (null_fraction if self._show_null else 0)
+        )
+
+    def expression(self) -> Expression:
+        attribute = getattr(Product, self._column_name)
+
+        operation = (
+            self.INVERTED_OPERATIONS[self._operation]
+            if self._inverted
+            else self._operation
+        )
+        expression = self.OPERATIONS[operation](attribute, self._value)
 
         if self._show_null:
-            products = products | Product.select().where(attribute.is_null())
+            expression = expression | attribute.is_null()
+
+        return expression
 
-        return set([product for product in products])
+    def mask(
+        self, index: ProductIndex, candidates: Bitmap = None,
+        record_sql: Callable[[str], None] = None
+    ) -> np.ndarray:
+        values, nulls = index.column(self._column_name)
+
+        mask = (
+            (self.OPERATIONS[self._operation](values, self._value)
+             != self._inverted)
+            & ~nulls
+        )
+
+        if self._show_null:
+            mask |= nulls
+
+        return mask
 
 
 class BooleanFilter(ProductFilter):
 
+    COST: float = 1.0
+    INDEXED: bool = True
+
     _show_null: bool
 
     def __init__(
@@ -195,17 +351,47 @@ class BooleanFilter(ProductFilter):
         self._show_null = show_null
         super().__init__(bool(value), operation, inverted, column_name)
 
-    def run(self) -> set[Product]:
-        attribute = getattr(Product, self._column_name)
+    def key(self) -> tuple:
+        return super().key() + (bool(self._show_null),)
 
-        products = Product.select().where(
-            (attribute != self._inverted)
+    def describe(self) -> str:
+        return (
+            f"{self.__class__.__name__}"
+            f"({self._column_name} == {not self._inverted})"
         )
 
+    def selectivity(self, statistics: ProductStatistics) -> float:
+        selectivity = (
+            statistics.false_fraction(self._column_name)
+            if self._inverted
+            else statistics.true_fraction(self._column_name)
+        )
+        if self._show_null:
+            selectivity += statistics.null_fraction(self._column_name)
+        return selectivity
+
+    def expression(self) -> Expression:
+        attribute = getattr(Product, self._column_name)
+
+        expression = attribute != self._inverted
+
+        if self._show_null:
+            expression = expression | attribute.is_null()
+
+        return expression
+
+    def mask(
+        self, index: ProductIndex, candidates: Bitmap = None,
+        record_sql: Callable[[str], None] = None
+    ) -> np.ndarray:
+        values, nulls = index.column(self._column_name)
+
+        mask = (values != self._inverted) & ~nulls
+
         if self._show_null:
-            products = products | Product.select().where(attribute.is_null())
+            mask |= nulls
 
-        return set([product for product in products])
+        return mask
 
 
 class TagAndColorFilter(ProductFilter):
@@ -218,33 +404,47 @@ class TagAndColorFilter(ProductFilter):
     ):
         super().__init__(str(value), operation, inverted, column_name)
 
-    def run(self) -> set[Product]:
+    def describe(self) -> str:
+        return (
+            f"{'NOT ' if self._inverted else ''}{self.__class__.__name__}"
+            f"({self.TABLE.__name__.lower()} {self._operation} "
+            f"{self._value!r})"
+        )
+
+    def selectivity(self, statistics: ProductStatistics) -> float:
+        selectivity = (
+            statistics.only_fraction(self.TABLE, self._value)
+            if self._operation == 'has_only'
+            else statistics.name_fraction(self.TABLE, self._value)
+        )
+        return 1 - selectivity if self._inverted else selectivity
+
+    def _product_ids(self, expression: Expression) -> Expression:
+        return (
+            self.X_TABLE.select(self.X_TABLE.product)
+            .join(self.TABLE)
+            .where(expression)
+        )
+
+    def expression(self) -> Expression:
         if self._operation == 'has':
-            products = (
-                Product.select().distinct()
-                .join(self.X_TABLE)
-                .join(self.TABLE).where(
-                    (self.TABLE.name == self._value)
-                )
+            expression = Product.id_.in_(
+                self._product_ids(self.TABLE.name == self._value)
             )
         elif self._operation == 'has_only':
-            products = (
-                Product.select()
-                .join(self.X_TABLE)
-                .join(self.TABLE)
-                .where(self.TABLE.name == self._value)
-                .where(~Product.id_.in_(
-                    Product.select(Product.id_)
-                    .join(self.X_TABLE)
-                    .join(self.TABLE)
-                    .where(self.TABLE.name != self._value)
-                ))
+            expression = (
+                Product.id_.in_(
+                    self._product_ids(self.TABLE.name == self._value)
+                )
+                & Product.id_.not_in(
+                    self._product_ids(self.TABLE.name != self._value)
+                )
             )
 
         if self._inverted:
-            products = Product.select().where(Product.id_.not_in(products))
+            expression = ~expression
 
-        return set([product for product in products])
+        return expression
 
 
 class TagFilter(TagAndColorFilter):
@@ -259,6 +459,34 @@ class ColorFilter(TagAndColorFilter):
     X_TABLE: BaseModel = ColorXProduct
 
 
+class CompiledFilter(ProductFilter):
+
+    _key: tuple
+    _label: str
+    _selectivity: float
+
+    def __init__(
+        self, expression: Expression, key: tuple, label: str,
+        selectivity: float
+    ):
+        super().__init__(expression, None, False, None)
+        self._key = key
+        self._label = label
+        self._selectivity = selectivity
+
+    def key(self) -> tuple:
+        return self._key
+
+    def describe(self) -> str:
+        return self._label
+
+    def selectivity(self, statistics: ProductStatistics) -> float:
+        return self._selectivity
+
+    def expression(self) -> Expression:
+        return self._value
+
+
 class ProductFilterEngine:
 
     COLUMN_NAME_REPLACEMENTS: dict[str, str] = {
@@ -272,23 +500,96 @@ class ProductFilterEngine:
 
     _raw_filters: list[dict[str, any]]
     _inverted: bool
+    _index: ProductIndex
+    _cache: FilterCache
+    _memo: PlanMemo
+    _profile: PlanProfile
+    _rpn: list[str]
+    _timings: dict[str, float]
+    _cache_hit: bool
     _tokens: list[Token]
-    _products: set[Product]
+    _ids: list[str]
+    _plan: PlanNode
+    _products: list[Product]
 
-    def __init__(self, raw_filters: list[dict[str, any]], inverted: bool):
+    def __init__(
+        self, raw_filters: list[dict[str, any]], inverted: bool,
+        index: ProductIndex = product_index, cache: FilterCache = None,
+        memo: PlanMemo = None, profile: bool = False
+    ):
         self._raw_filters = raw_filters
         self._inverted = inverted
+        self._index = index
+        self._cache = cache
+        self._memo = memo
+        self._profile = PlanProfile() if profile else None
+        self._rpn = []
+        self._timings = {}
+        self._cache_hit = False
         self._tokens = []
+        self._plan = None
+        self._products = None
 
     def run(self):
+        start = time.perf_counter()
         if len(self._raw_filters) == 0:
-            self._products = set([product for product in Product.select()])
+            self._ids = [
+                id_ for (id_,) in Product.select(Product.id_).tuples()
+            ]
+            self._timings['run'] = time.perf_counter() - start
             return
+        self._prepare()
+        self._timings['prepare'] = time.perf_counter() - start
+
+        if self._cache is not None:
+            key = self.canonical_key()
+            version = CatalogVersion.get()
+            # Profiling always evaluates so that the timings are real.
+            if (
+                self._profile is None
+                and (ids := self._cache.get(key, version)) is not None
+            ):
+                self._ids = ids
+                self._cache_hit = True
+                self._timings['run'] = time.perf_counter() - start
+                return
+
+        self._filter_products()
+        self._timings['run'] = time.perf_counter() - start
+
+        if self._cache is not None:
+            self._cache.put(key, version, self._ids)
+
+    @classmethod
+    def run_batch(
+        cls, queries: list[dict[str, any]],
+        index: ProductIndex = product_index, cache: FilterCache = None
+    ) -> list[ProductFilterEngine]:
+        memo = PlanMemo()
+        engines = [
+            cls(
+                query['filters'], query['inverted'], index=index,
+                cache=cache, memo=memo
+            )
+            for query in queries
+        ]
+        for engine in engines:
+            engine.run()
+        return engines
+
+    def match_ids(self, ids: list[str]) -> list[str]:
+        query = Product.select(Product.id_).where(Product.id_.in_(ids))
+        if len(self._raw_filters) > 0:
+            self._prepare()
+            query = query.where(self._compile_expression())
+        return [id_ for (id_,) in query.tuples()]
+
+    def _prepare(self):
         self._tokenize(self._raw_filters)
         self._shunting_yard()
         if self._inverted:
             self._tokens.append(OperatorToken(OperatorToken.NOT))
-        self._filter_products()
+        self._rpn = [str(token) for token in self._tokens]
 
     def _tokenize(
         self, raw_filters: list[dict[str, any]]
@@ -404,38 +705,186 @@ class ProductFilterEngine:
             output_queue.append(token_stack.pop())
         self._tokens = output_queue
 
+    def _build_plan(self) -> PlanNode:
+        statistics = ProductStatistics.current(self._index)
+        node_stack = []
+        for token in self._tokens:
+            if isinstance(token, FilterToken):
+                node_stack.append(FilterPlanNode(token.filter_, statistics))
+            elif isinstance(token, OperatorToken):
+                if token == OperatorToken(OperatorToken.NOT):
+                    node_stack.append(NotPlanNode(node_stack.pop()))
+                    continue
+                node_class = (
+                    OrPlanNode
+                    if token == OperatorToken(OperatorToken.OR)
+                    else AndPlanNode
+                )
+                b = node_stack.pop()
+                a = node_stack.pop()
+                children = []
+                for node in (a, b):
+                    if isinstance(node, node_class):
+                        children.extend(node.children)
+                    else:
+                        children.append(node)
+                node_stack.append(node_class(children))
+        return node_stack.pop()
+
+    @staticmethod
+    def _is_sql(node: PlanNode) -> bool:
+        return (
+            isinstance(node, FilterPlanNode) and not node.filter_.INDEXED
+        )
+
+    def _compiled_node(
+        self, node: PlanNode, expression: Expression, label: str
+    ) -> FilterPlanNode:
+        return FilterPlanNode(
+            CompiledFilter(expression, node.key, label, node.selectivity),
+            None
+        )
+
+    def _compile_plan(self, node: PlanNode) -> PlanNode:
+        # Every subtree that only holds SQL-backed filters is folded into
+        # a single leaf, so that it costs one query instead of one per
+        # filter.
+        if isinstance(node, NotPlanNode):
+            child = self._compile_plan(node.child)
+            node = NotPlanNode(child)
+            if not self._is_sql(child):
+                return node
+            return self._compiled_node(
+                node, ~fn.COALESCE(child.filter_.expression(), False),
+                f"NOT {child.label()}"
+            )
+        if not isinstance(node, (AndPlanNode, OrPlanNode)):
+            return node
+        children = [self._compile_plan(child) for child in node.children]
+        sql_children = [child for child in children if self._is_sql(child)]
+        if len(sql_children) < 2:
+            return node.__class__(children)
+        combine = (
+            operator.and_ if isinstance(node, AndPlanNode) else operator.or_
+        )
+        expression = sql_children[0].filter_.expression()
+        for child in sql_children[1:]:
+            expression = combine(expression, child.filter_.expression())
+        compiled = self._compiled_node(
+            node.__class__(sql_children), expression,
+            f" {node.label()} ".join(
+                f"({child.label()})" for child in sql_children
+            )
+        )
+        if len(sql_children) == len(children):
+            return compiled
+        return node.__class__([
+            child for child in children if not self._is_sql(child)
+        ] + [compiled])
+
     def _filter_products(self):
-        token_stack = []
+        self._plan = self._compile_plan(self._build_plan())
+        self._ids = self._index.ids(self._plan.execute(
+            self._index, memo=self._memo, profile=self._profile
+        ))
+
+    def _compile_expression(self) -> Expression:
+        expression_stack = []
         for token in self._tokens:
             if isinstance(token, FilterToken):
-                try:
-                    token_stack.append(token.filter_.run())
-                except DoesNotExist:
-                    token_stack.append(set())
+                expression_stack.append(token.filter_.expression())
             elif isinstance(token, OperatorToken):
                 if token == OperatorToken(OperatorToken.NOT):
-                    a = token_stack.pop()
-                    token_stack.append(set([
-                        p for p in
-                        Product.select().where(Product.id_.not_in(a))
-                    ]))
+                    # A NULL predicate counts as a non-match, so its
+                    # complement has to count as a match.
+                    a = expression_stack.pop()
+                    expression_stack.append(~fn.COALESCE(a, False))
                     continue
-                b = token_stack.pop()
-                a = token_stack.pop()
+                b = expression_stack.pop()
+                a = expression_stack.pop()
                 if token == OperatorToken(OperatorToken.OR):
-                    token_stack.append(a | b)
+                    expression_stack.append(a | b)
                 elif token == OperatorToken(OperatorToken.AND):
-                    token_stack.append(a & b)
-        self._products = token_stack.pop()
+                    expression_stack.append(a & b)
+        return expression_stack.pop()
+
+    def _canonical_tree(self) -> tuple:
+        node_stack = []
+        for token in self._tokens:
+            if isinstance(token, FilterToken):
+                node_stack.append(token.filter_.key())
+            elif isinstance(token, OperatorToken):
+                if token == OperatorToken(OperatorToken.NOT):
+                    a = node_stack.pop()
+                    node_stack.append(
+                        a[1] if a[0] == OperatorToken.NOT
+                        else (OperatorToken.NOT, a)
+                    )
+                    continue
+                b = node_stack.pop()
+                a = node_stack.pop()
+                operands = set()
+                for node in (a, b):
+                    if node[0] == token.operator:
+                        operands.update(node[1])
+                    else:
+                        operands.add(node)
+                node_stack.append(
+                    (token.operator, tuple(sorted(operands, key=repr)))
+                )
+        return node_stack.pop()
+
+    def explain(self) -> dict[str, any]:
+        explanation = {
+            'rpn': self._rpn,
+            'cache_hit': self._cache_hit,
+            'rows': len(self._ids),
+            'timings': self._timings
+        }
+        if self._plan is not None:
+            explanation['plan'] = (
+                self._profile.explain(self._plan)
+                if self._profile is not None else str(self._plan)
+            )
+        return explanation
+
+    def canonical_key(self) -> str:
+        return hashlib.sha256(
+            repr(self._canonical_tree()).encode()
+        ).hexdigest()
+
+    @property
+    def plan(self) -> PlanNode:
+        return self._plan
+
+    @property
+    def ids(self) -> list[str]:
+        return self._ids
 
     @property
     def products(self) -> list[Product]:
-        return list(self._products)
+        if self._products is None:
+            self._products = self._index.hydrate(self._ids)
+        return self._products
 
 
 if __name__ == "__main__":
+    explain = "--explain" in sys.argv
     inversed = True
     raw_filters = [{'uuid': 'cd4a4588-2a35-4d40-b54e-46a49d5f6484', 'type': 'number', 'value': '0.01', 'operation': '<', 'inverted': False, 'columnName': 'nem_per_second', 'operator': 'and'}]
-    engine = ProductFilterEngine(raw_filters, inversed)
+    engine = ProductFilterEngine(
+        raw_filters, inversed, profile=explain
+    )
     engine.run()
-    print([p.name for p in engine.products])
+    if explain:
+        explanation = engine.explain()
+        start = time.perf_counter()
+        products = engine.products
+        explanation['timings']['hydrate'] = time.perf_counter() - start
+        start = time.perf_counter()
+        Product.to_dicts(products)
+        explanation['timings']['to_dict'] = time.perf_counter() - start
+        print(json.dumps(explanation, indent=4))
+    else:
+        print(engine.plan)
+        print([p.name for p in engine.products])
@@ -0,0 +1,211 @@
+from threading import RLock
+
+import numpy as np
+from bitmap import Bitmap
+from catalog_version import CatalogVersion
+from db.base_model import db
+from peewee import Expression, Query
+from product import Product
+
+
+class ProductIndex:
+
+    NUMBER_FIELDS: list[str] = [
+        'price', 'weight', 'min_caliber', 'max_caliber', 'min_height',
+        'max_height', 'raw_shot_count', 'duration', 'nem', 'package_size',
+        'shot_count', 'nem_per_second', 'nem_per_shot', 'shots_per_second',
+        'price_per_shot', 'price_per_second', 'price_per_nem'
+    ]
+    BOOLEAN_FIELDS: list[str] = [
+        'fan', 'availability', 'shot_count_has_multiplier', 'is_new',
+        'rating', 'rated'
+    ]
+    INITIAL_CAPACITY: int = 1024
+    HYDRATION_CHUNK_SIZE: int = 500
+
+    _ids: list[str]
+    _ordinals: dict[str, int]
+    _values: dict[str, np.ndarray]
+    _nulls: dict[str, np.ndarray]
+    _id_array: np.ndarray
+    _version: int
+    _built: bool
+    _lock: RLock
+
+    def __init__(self):
+        self._ids = []
+        self._ordinals = {}
+        self._values = {}
+        self._nulls = {}
+        self._id_array = None
+        self._version = None
+        self._built = False
+        self._lock = RLock()
+
+    @property
+    def size(self) -> int:
+        return len(self._ids)
+
+    @property
+    def capacity(self) -> int:
+        return len(self._nulls['price']) if self._nulls else 0
+
+    def _allocate(self, capacity: int):
+        for field_name in self.NUMBER_FIELDS:
+            self._values[field_name] = np.zeros(capacity, dtype=np.float64)
+            self._nulls[field_name] = np.ones(capacity, dtype=np.bool_)
+        for field_name in self.BOOLEAN_FIELDS:
+            self._values[field_name] = np.zeros(capacity, dtype=np.bool_)
+            self._nulls[field_name] = np.ones(capacity, dtype=np.bool_)
+
+    def _grow(self):
+        capacity = max(self.INITIAL_CAPACITY, 2 * self.capacity)
+        for field_name in self._values:
+            values = np.zeros(capacity, dtype=self._values[field_name].dtype)
+            nulls = np.ones(capacity, dtype=np.bool_)
+            values[:self.size] = self._values[field_name][:self.size]
+            nulls[:self.size] = self._nulls[field_name][:self.size]
+            self._values[field_name] = values
+            self._nulls[field_name] = nulls
+
+    def _write(self, ordinal: int, values: tuple[any]):
+        for field_name, value in zip(self._values, values):
+            self._nulls[field_name][ordinal] = value is None
+            self._values[field_name][ordinal] = (
+                0 if value is None else value
+            )
+
+    def _append(self, id_: str, values: tuple[any]):
+        if self.size == self.capacity:
+            self._grow()
+        ordinal = self.size
+        self._ids.append(id_)
+        self._ordinals[id_] = ordinal
+        self._id_array = None
+        self._write(ordinal, values)
+
+    def _store(self, id_: str, values: tuple[any]):
+        if (ordinal := self._ordinals.get(id_)) is None:
+            self._append(id_, values)
+        else:
+            self._write(ordinal, values)
+
+    def _select_rows(self, where: Expression = None) -> list[tuple]:
+        fields = [getattr(Product, field_name) for field_name in self._values]
+        query = Product.select(Product.id_, *fields)
+        if where is not None:
+            query = query.where(where)
+        return list(query.tuples())
+
+    def build(self):
+        with self._lock:
+            self._ids = []
+            self._ordinals = {}
+            self._id_array = None
+            self._allocate(self.INITIAL_CAPACITY)
+            # One read transaction, so the version matches the rows.
+            with db.atomic():
+                self._version = CatalogVersion.shared()
+                rows = self._select_rows()
+            for id_, *values in rows:
+                self._append(id_, values)
+            self._built = True
+
+    def ensure_built(self):
+        with self._lock:
+            if not self._built:
+                self.build()
+
+    def refresh(self, product: Product):
+        with self._lock:
+            if not self._built:
+                return
+            self._store(product.id_, tuple(
+                getattr(product, field_name) for field_name in self._values
+            ))
+
+    def sync(self) -> bool:
+        self.ensure_built()
+        if CatalogVersion.shared() <= self._version:
+            return False
+        with self._lock:
+            applied = self._version
+            with db.atomic():
+                shared = CatalogVersion.shared()
+                if shared <= applied:
+                    return False
+                rows = self._select_rows(Product.catalog_version > applied)
+            for id_, *values in rows:
+                self._store(id_, values)
+            self._version = shared
+            return CatalogVersion.advance(applied, shared)
+
+    def column(self, field_name: str) -> tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            self.ensure_built()
+            return (
+                self._values[field_name][:self.size],
+                self._nulls[field_name][:self.size]
+            )
+
+    def empty_mask(self) -> np.ndarray:
+        with self._lock:
+            self.ensure_built()
+            return np.zeros(self.size, dtype=np.bool_)
+
+    def mask_from_query(self, query: Query) -> np.ndarray:
+        rows = list(query.tuples())
+        with self._lock:
+            mask = self.empty_mask()
+            for (id_,) in rows:
+                if (ordinal := self._ordinals.get(id_)) is not None:
+                    mask[ordinal] = True
+            return mask
+
+    def universe(self) -> Bitmap:
+        with self._lock:
+            self.ensure_built()
+            return Bitmap.full(self.size)
+
+    def id_array(self) -> np.ndarray:
+        with self._lock:
+            self.ensure_built()
+            if self._id_array is None:
+                self._id_array = np.array(self._ids, dtype=np.str_)
+            return self._id_array
+
+    def contains(self, id_: str) -> bool:
+        with self._lock:
+            self.ensure_built()
+            return id_ in self._ordinals
+
+    def ordinals(self, ids: list[str]) -> np.ndarray:
+        with self._lock:
+            self.ensure_built()
+            return np.array(
+                [self._ordinals[id_] for id_ in ids if id_ in self._ordinals],
+                dtype=np.int64
+            )
+
+    def ids_for(self, ordinals: np.ndarray) -> list[str]:
+        with self._lock:
+            return [self._ids[ordinal] for ordinal in ordinals]
+
+    def ids(self, bitmap: Bitmap) -> list[str]:
+        return self.ids_for(bitmap.ordinals())
+
+    def hydrate(
+        self, ids: list[str], fields: list[str] = None
+    ) -> list[Product]:
+        columns = Product.select_columns(fields)
+        products = {}
+        for i in range(0, len(ids), self.HYDRATION_CHUNK_SIZE):
+            products.update(
+                (product.id_, product) for product in
+                Product.select(*columns)
+                .where(Product.id_.in_(ids[i:i + self.HYDRATION_CHUNK_SIZE]))
+            )
+        return [products[id_] for id_ in ids if id_ in products]
+
+
+product_index: ProductIndex = ProductIndex()
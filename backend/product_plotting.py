@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+from static_files import StaticFiles
+
+
+class ProductPlottingMixin:
+
+    PLOTS_DIRECTORY: str = "backend/static/product_plots"
+    PLOTS_URL: str = "/static/product_plots"
+    LIGHTGREEN = '#90EE90'
+    LIGHTRED = '#FFC0CB'
+    LIGHTGRAY = '#D3D3D3'
+
+    COLOR_MODE: dict[str, str] = {
+        'price': 'low',
+        'weight': 'high',
+        'min_caliber': 'neutral',
+        'max_caliber': 'neutral',
+        'min_height': 'neutral',
+        'max_height': 'neutral',
+        'shot_count': 'high',
+        'duration': 'high',
+        'nem': 'high',
+        'nem_per_second': 'high',
+        'nem_per_shot': 'high',
+        'shots_per_second': 'high',
+        'price_per_shot': 'low',
+        'price_per_second': 'low',
+        'price_per_nem': 'low'
+    }
+
+    def _get_values(self, field_name: str) -> np.ndarray:
+        values = np.array([
+            value for (value,) in
+            type(self).select(getattr(type(self), field_name))
+            .where(getattr(type(self), field_name).is_null(False))
+            .tuples()
+        ])
+        return values
+
+    def _create_plot(self, field_name: str) -> str:
+        # Imported on demand so that serving the API does not load
+        # matplotlib.
+        import matplotlib.pyplot as plt
+        values = self._get_values(field_name)
+
+        fig, ax = plt.subplots()
+        fig.set_figwidth(10)
+        fig.set_figheight(1)
+
+        boxplot = ax.boxplot(
+            x=values, vert=False, whis=[5, 95], notch=True,
+            medianprops={'color': 'black'}, patch_artist=True,
+            showfliers=False,
+            widths=[0.99]
+        )
+
+        median = boxplot['medians'][0].get_xdata()[0]
+        if (value := getattr(self, field_name)) is None:
+            box_color = self.LIGHTGRAY
+        elif self.COLOR_MODE[field_name] == 'low':
+            box_color = self.LIGHTGREEN if value < median else self.LIGHTRED
+        elif self.COLOR_MODE[field_name] == 'high':
+            box_color = self.LIGHTGREEN if value > median else self.LIGHTRED
+        else:
+            box_color = self.LIGHTGRAY
+
+        boxplot['boxes'][0].set_facecolor(box_color)
+        try:
+            ax.axvline(
+                value, 0, 1000, color='black',
+                linewidth=3
+            )
+        except TypeError:
+            return
+        ax.legend_ = None
+        for pos in ('top', 'right', 'bottom', 'left'):
+            ax.spines[pos].set_visible(False)
+        ax.get_xaxis().set_ticks([])
+        ax.get_yaxis().set_ticks([])
+        filename = os.path.join(
+            self.PLOTS_DIRECTORY,
+            f"{self.id_}_{field_name}.svg"
+        )
+        os.makedirs(self.PLOTS_DIRECTORY, exist_ok=True)
+        fig.savefig(filename)
+        plt.close(fig)
+        StaticFiles.compress(filename)
+        return filename
+
+    def _plot_url(self, field_name: str) -> str:
+        url = f"{self.PLOTS_URL}/{self.id_}_{field_name}.svg"
+        digest = StaticFiles.digest(os.path.join(
+            self.PLOTS_DIRECTORY, f"{self.id_}_{field_name}.svg"
+        ))
+        return url if digest is None else f"{url}?v={digest}"
+
+    def plot_urls(self) -> dict[str, str]:
+        return {
+            field_name: self._plot_url(field_name)
+            for field_name in self.COLOR_MODE
+        }
+
+    def create_plots(self) -> dict[str, str]:
+        return {
+            field_name: self._create_plot(field_name)
+            for field_name in self.COLOR_MODE
+        }
@@ -0,0 +1,85 @@
+from __future__ import annotations
+import numpy as np
+from product_index import ProductIndex
+
+
+class ProductRanking:
+
+    MAX_K: int = 1000
+    DEFAULT_K: int = 20
+
+    _index: ProductIndex
+    _weights: dict[str, float]
+    _descending: bool
+    _k: int
+
+    def __init__(
+        self, index: ProductIndex, weights: dict[str, float],
+        descending: bool = False, k: int = DEFAULT_K
+    ):
+        if not weights:
+            raise ValueError("Empty ranking")
+        for field_name in weights:
+            if field_name not in index.NUMBER_FIELDS:
+                raise ValueError(f"Invalid rank field: {field_name}")
+        self._index = index
+        self._weights = weights
+        self._descending = descending
+        self._k = max(1, min(k, self.MAX_K))
+
+    @classmethod
+    def from_args(cls, index: ProductIndex, args: dict) -> ProductRanking:
+        return cls(
+            index,
+            cls.parse_weights(args['rank']),
+            args.get('order', 'asc') == 'desc',
+            int(args.get('k', cls.DEFAULT_K))
+        )
+
+    @staticmethod
+    def parse_weights(rank: str) -> dict[str, float]:
+        weights = {}
+        for term in rank.split(','):
+            field_name, _, weight = term.partition(':')
+            try:
+                weights[field_name.strip()] = float(weight) if weight else 1.0
+            except ValueError:
+                raise ValueError(f"Invalid rank weight: {term}")
+        return weights
+
+    def _scores(self, ordinals: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        scores = np.zeros(len(ordinals), dtype=np.float64)
+        valid = np.ones(len(ordinals), dtype=np.bool_)
+        single = len(self._weights) == 1
+        for field_name, weight in self._weights.items():
+            values, nulls = self._index.column(field_name)
+            if single:
+                column = values[ordinals]
+            else:
+                # Scale every metric to [0, 1] over the whole catalog so
+                # that the weights are comparable across units.
+                known = values[~nulls]
+                low, high = (
+                    (known.min(), known.max()) if len(known) else (0, 0)
+                )
+                column = (
+                    (values[ordinals] - low) / (high - low)
+                    if high > low else np.zeros(len(ordinals))
+                )
+            scores += weight * column
+            valid &= ~nulls[ordinals]
+        if self._descending:
+            scores = -scores
+        return scores[valid], ordinals[valid]
+
+    def top(self, ids: list[str]) -> list[str]:
+        scores, ordinals = self._scores(self._index.ordinals(ids))
+        if len(scores) > self._k:
+            threshold = np.partition(scores, self._k - 1)[self._k - 1]
+            # Keep every tie at the threshold so that the final sort can
+            # break ties by id.
+            selection = scores <= threshold
+            scores, ordinals = scores[selection], ordinals[selection]
+        sort_ids = self._index.id_array()[ordinals]
+        order = np.lexsort((sort_ids, scores))[:self._k]
+        return self._index.ids_for(ordinals[order])
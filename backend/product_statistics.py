@@ -0,0 +1,141 @@
+from __future__ import annotations
+import numpy as np
+from catalog_version import CatalogVersion
+from db.base_model import BaseModel
+from peewee import fn
+from product import Color, ColorXProduct, Tag, TagXProduct
+from product_index import ProductIndex
+
+
+class ProductStatistics:
+
+    HISTOGRAM_BINS: int = 32
+    RELATIONS: list[tuple[BaseModel, BaseModel]] = [
+        (Tag, TagXProduct),
+        (Color, ColorXProduct)
+    ]
+
+    _current: ProductStatistics = None
+
+    size: int
+    version: int
+    _null_counts: dict[str, int]
+    _true_counts: dict[str, int]
+    _distinct_counts: dict[str, int]
+    _histograms: dict[str, tuple[np.ndarray, np.ndarray]]
+    _name_counts: dict[str, dict[str, int]]
+    _only_counts: dict[str, dict[str, int]]
+
+    def __init__(self, index: ProductIndex):
+        self.size = index.size
+        self.version = CatalogVersion.get()
+        self._null_counts = {}
+        self._true_counts = {}
+        self._distinct_counts = {}
+        self._histograms = {}
+        self._name_counts = {}
+        self._only_counts = {}
+        for field_name in index.NUMBER_FIELDS:
+            self._collect_number_column(field_name, *index.column(field_name))
+        for field_name in index.BOOLEAN_FIELDS:
+            self._collect_boolean_column(
+                field_name, *index.column(field_name)
+            )
+        for table, x_table in self.RELATIONS:
+            self._collect_relation(table, x_table)
+
+    @classmethod
+    def current(cls, index: ProductIndex) -> ProductStatistics:
+        index.ensure_built()
+        if (
+            cls._current is None
+            or cls._current.version != CatalogVersion.get()
+            or cls._current.size != index.size
+        ):
+            cls._current = cls(index)
+        return cls._current
+
+    def _collect_number_column(
+        self, field_name: str, values: np.ndarray, nulls: np.ndarray
+    ):
+        values = values[~nulls]
+        self._null_counts[field_name] = int(nulls.sum())
+        self._distinct_counts[field_name] = len(np.unique(values))
+        if len(values):
+            self._histograms[field_name] = np.histogram(
+                values, bins=self.HISTOGRAM_BINS
+            )
+
+    def _collect_boolean_column(
+        self, field_name: str, values: np.ndarray, nulls: np.ndarray
+    ):
+        self._null_counts[field_name] = int(nulls.sum())
+        self._true_counts[field_name] = int((values & ~nulls).sum())
+
+    def _collect_relation(self, table: BaseModel, x_table: BaseModel):
+        self._name_counts[table.__name__] = {
+            name: count for name, count in
+            x_table.select(table.name, fn.COUNT(fn.DISTINCT(x_table.product)))
+            .join(table)
+            .group_by(table.name)
+            .tuples()
+        }
+        only_counts = {}
+        for _, name, count in (
+            x_table.select(
+                x_table.product, fn.MIN(table.name),
+                fn.COUNT(fn.DISTINCT(table.name))
+            )
+            .join(table)
+            .group_by(x_table.product)
+            .tuples()
+        ):
+            if count == 1:
+                only_counts[name] = only_counts.get(name, 0) + 1
+        self._only_counts[table.__name__] = only_counts
+
+    def _fraction(self, count: int) -> float:
+        return count / self.size if self.size else 0.0
+
+    def null_fraction(self, field_name: str) -> float:
+        return self._fraction(self._null_counts[field_name])
+
+    def true_fraction(self, field_name: str) -> float:
+        return self._fraction(self._true_counts[field_name])
+
+    def false_fraction(self, field_name: str) -> float:
+        return self._fraction(
+            self.size
+            - self._true_counts[field_name]
+            - self._null_counts[field_name]
+        )
+
+    def equal_fraction(self, field_name: str) -> float:
+        distinct_count = self._distinct_counts[field_name]
+        return 1 / distinct_count if distinct_count else 0.0
+
+    def below_fraction(self, field_name: str, value: float) -> float:
+        if field_name not in self._histograms:
+            return 0.0
+        counts, edges = self._histograms[field_name]
+        if value <= edges[0]:
+            return 0.0
+        if value >= edges[-1]:
+            return 1.0
+        bucket = int(np.searchsorted(edges, value, side='right')) - 1
+        partial = (
+            counts[bucket] * (value - edges[bucket])
+            / (edges[bucket + 1] - edges[bucket])
+        )
+        return float((counts[:bucket].sum() + partial) / counts.sum())
+
+    def histogram_edges(self, field_name: str) -> np.ndarray:
+        if field_name not in self._histograms:
+            return None
+        return self._histograms[field_name][1]
+
+    def name_fraction(self, table: BaseModel, name: str) -> float:
+        return self._fraction(self._name_counts[table.__name__].get(name, 0))
+
+    def only_fraction(self, table: BaseModel, name: str) -> float:
+        return self._fraction(self._only_counts[table.__name__].get(name, 0))
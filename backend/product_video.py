@@ -0,0 +1,52 @@
+import os
+
+
+class ProductVideoMixin:
+
+    YOUTUBE_LINK_PREFIX: str = "https://www.youtube.com/watch?v="
+    OUTPUT_DIRECTORY: str = "backend/static/videos"
+
+    def download_video(self, temp_directory: str):
+        if self.youtube_handle is None or self.youtube_handle == "":
+            return
+        output_filename = os.path.join(
+            self.OUTPUT_DIRECTORY, f"{self.id_}.mp4"
+        )
+        if os.path.exists(output_filename):
+            return
+        # Imported on demand so that serving the API does not load the
+        # video stack.
+        import ffmpeg
+        from pytube import YouTube
+        youtube = YouTube(
+            f"{self.YOUTUBE_LINK_PREFIX}{self.youtube_handle}"
+        )
+        video_stream = (
+            youtube.streams.filter(mime_type='video/mp4')
+            .order_by('resolution')
+            .desc()
+            .first()
+        )
+        audio_stream = (
+            youtube.streams.filter(mime_type='audio/mp4')
+            .order_by('bitrate')
+            .desc()
+            .first()
+        )
+        video_stream.download(temp_directory, filename=f"{self.id_}.mp4")
+        audio_stream.download(temp_directory, filename=f"{self.id_}.mp3")
+        video_data = ffmpeg.input(
+            os.path.join(temp_directory, f"{self.id_}.mp4")
+        )
+        audio_data = ffmpeg.input(
+            os.path.join(temp_directory, f"{self.id_}.mp3")
+        )
+        ffmpeg.output(
+            video_data,
+            audio_data,
+            output_filename,
+            vcodec='copy',
+            acodec='aac'
+        ).run()
+        os.remove(os.path.join(temp_directory, f"{self.id_}.mp4"))
+        os.remove(os.path.join(temp_directory, f"{self.id_}.mp3"))
@@ -0,0 +1,270 @@
+from __future__ import annotations
+import time
+from abc import ABC, abstractmethod
+from bitmap import Bitmap
+from product_index import ProductIndex
+from product_statistics import ProductStatistics
+
+
+class PlanMemo:
+
+    _results: dict[tuple, tuple[Bitmap, Bitmap]]
+    hits: int
+    misses: int
+
+    def __init__(self):
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, scope: Bitmap) -> Bitmap:
+        if (entry := self._results.get(key)) is None:
+            self.misses += 1
+            return None
+        known_scope, result = entry
+        if scope & ~known_scope:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result & scope
+
+    def put(self, key: tuple, scope: Bitmap, result: Bitmap):
+        if (entry := self._results.get(key)) is not None:
+            known_scope, known_result = entry
+            scope = scope | known_scope
+            result = result | known_result
+        self._results[key] = (scope, result)
+
+
+class PlanProfile:
+
+    _entries: dict[int, list[float, int, int]]
+    _queries: dict[int, str]
+
+    def __init__(self):
+        self._entries = {}
+        self._queries = {}
+
+    def record(self, node: PlanNode, elapsed: float, rows: int):
+        entry = self._entries.setdefault(id(node), [0.0, 0, 0])
+        entry[0] += elapsed
+        entry[1] = rows
+        entry[2] += 1
+
+    def record_sql(self, node: PlanNode, sql: str):
+        self._queries[id(node)] = sql
+
+    def elapsed(self, node: PlanNode) -> float:
+        return self._entries.get(id(node), [0.0, 0, 0])[0]
+
+    def explain(self, node: PlanNode) -> dict[str, any]:
+        elapsed, rows, calls = self._entries.get(id(node), [0.0, 0, 0])
+        explanation = {
+            'node': node.label(),
+            'selectivity': node.selectivity,
+            'cost': node.cost,
+            'time': elapsed,
+            'rows': rows,
+            'calls': calls
+        }
+        children = node.child_nodes()
+        if children:
+            explanation['set_operation_time'] = max(
+                0.0, elapsed - sum(self.elapsed(child) for child in children)
+            )
+            explanation['children'] = [
+                self.explain(child) for child in children
+            ]
+        elif not node.uses_sql():
+            explanation['access'] = 'index'
+        else:
+            explanation['access'] = 'sql'
+            # The query as it ran, candidate restriction included; None
+            # if the leaf was skipped.
+            explanation['sql'] = self._queries.get(id(node))
+        return explanation
+
+
+class PlanNode(ABC):
+
+    selectivity: float
+    cost: float
+    key: tuple
+
+    def execute(
+        self, index: ProductIndex, candidates: Bitmap = None,
+        memo: PlanMemo = None, profile: PlanProfile = None
+    ) -> Bitmap:
+        start = time.perf_counter()
+        result = self._execute_memoized(index, candidates, memo, profile)
+        if profile is not None:
+            profile.record(self, time.perf_counter() - start, len(result))
+        return result
+
+    def _execute_memoized(
+        self, index: ProductIndex, candidates: Bitmap, memo: PlanMemo,
+        profile: PlanProfile
+    ) -> Bitmap:
+        if memo is None:
+            return self._execute(index, candidates, memo, profile)
+        scope = candidates if candidates is not None else index.universe()
+        if (result := memo.get(self.key, scope)) is not None:
+            return result
+        result = self._execute(index, candidates, memo, profile) & scope
+        memo.put(self.key, scope, result)
+        return result
+
+    @abstractmethod
+    def _execute(
+        self, index: ProductIndex, candidates: Bitmap, memo: PlanMemo,
+        profile: PlanProfile
+    ) -> Bitmap:
+        pass
+
+    @abstractmethod
+    def label(self) -> str:
+        pass
+
+    def child_nodes(self) -> list[PlanNode]:
+        return []
+
+    def uses_sql(self) -> bool:
+        return False
+
+    def format(self, depth: int = 0) -> list[str]:
+        return [self._line(depth, self.label())] + [
+            line for child in self.child_nodes()
+            for line in child.format(depth + 1)
+        ]
+
+    def _line(self, depth: int, label: str) -> str:
+        return (
+            f"{'  ' * depth}{label} "
+            f"(selectivity={self.selectivity:.4f}, cost={self.cost:.1f})"
+        )
+
+    def __str__(self) -> str:
+        return "\n".join(self.format())
+
+
+class FilterPlanNode(PlanNode):
+
+    filter_: any
+
+    def __init__(self, filter_: any, statistics: ProductStatistics):
+        self.filter_ = filter_
+        self.selectivity = min(max(filter_.selectivity(statistics), 0.0), 1.0)
+        self.cost = filter_.COST
+        self.key = filter_.key()
+
+    def _execute(
+        self, index: ProductIndex, candidates: Bitmap, memo: PlanMemo,
+        profile: PlanProfile
+    ) -> Bitmap:
+        return self.filter_.bitmap(
+            index, candidates,
+            None if profile is None
+            else lambda sql: profile.record_sql(self, sql)
+        )
+
+    def label(self) -> str:
+        return self.filter_.describe()
+
+    def uses_sql(self) -> bool:
+        # Indexed filters are evaluated in NumPy and never run their SQL.
+        return not self.filter_.INDEXED
+
+
+class NotPlanNode(PlanNode):
+
+    child: PlanNode
+
+    def __init__(self, child: PlanNode):
+        self.child = child
+        self.selectivity = 1 - child.selectivity
+        self.cost = child.cost
+        self.key = ('not', child.key)
+
+    def _execute(
+        self, index: ProductIndex, candidates: Bitmap, memo: PlanMemo,
+        profile: PlanProfile
+    ) -> Bitmap:
+        return ~self.child.execute(index, candidates, memo, profile)
+
+    def label(self) -> str:
+        return "NOT"
+
+    def child_nodes(self) -> list[PlanNode]:
+        return [self.child]
+
+
+class AndPlanNode(PlanNode):
+
+    children: list[PlanNode]
+
+    def __init__(self, children: list[PlanNode]):
+        self.children = sorted(
+            children, key=lambda child: (child.selectivity, child.cost)
+        )
+        self.selectivity, self.cost = 1.0, 0.0
+        for child in self.children:
+            self.cost += child.cost * self.selectivity
+            self.selectivity *= child.selectivity
+        self.key = ('and', tuple(sorted(
+            {child.key for child in self.children}, key=repr
+        )))
+
+    def _execute(
+        self, index: ProductIndex, candidates: Bitmap, memo: PlanMemo,
+        profile: PlanProfile
+    ) -> Bitmap:
+        result = candidates if candidates is not None else index.universe()
+        for child in self.children:
+            result = result & child.execute(index, result, memo, profile)
+            if not result:
+                break
+        return result
+
+    def label(self) -> str:
+        return "AND"
+
+    def child_nodes(self) -> list[PlanNode]:
+        return self.children
+
+
+class OrPlanNode(PlanNode):
+
+    children: list[PlanNode]
+
+    def __init__(self, children: list[PlanNode]):
+        self.children = sorted(
+            children, key=lambda child: (-child.selectivity, child.cost)
+        )
+        miss = 1.0
+        for child in self.children:
+            miss *= 1 - child.selectivity
+        self.selectivity = 1 - miss
+        self.cost = sum(child.cost for child in self.children)
+        self.key = ('or', tuple(sorted(
+            {child.key for child in self.children}, key=repr
+        )))
+
+    def _execute(
+        self, index: ProductIndex, candidates: Bitmap, memo: PlanMemo,
+        profile: PlanProfile
+    ) -> Bitmap:
+        result = Bitmap.empty(index.size)
+        scope = candidates if candidates is not None else index.universe()
+        for child in self.children:
+            result = result | child.execute(
+                index, candidates, memo, profile
+            )
+            if not (scope & ~result):
+                break
+        return result
+
+    def label(self) -> str:
+        return "OR"
+
+    def child_nodes(self) -> list[PlanNode]:
+        return self.children
@@ -0,0 +1,106 @@
+from threading import Lock
+
+from peewee import SQL, fn
+from product import Product, Tag, TagXProduct
+
+
+class RatingProgress:
+
+    _lock: Lock = Lock()
+    _loaded: bool = False
+    _product_count: int = 0
+    _rated_count: int = 0
+    _by_availability: dict[bool, list[int]] = {}
+    _by_tag: dict[str, list[int]] = {}
+
+    @classmethod
+    def _load(cls):
+        product_count, rated_count = (
+            Product.select(fn.COUNT(SQL("*")), fn.SUM(Product.rated))
+            .tuples()
+            .get()
+        )
+        cls._product_count = product_count
+        cls._rated_count = rated_count or 0
+        cls._by_availability = {
+            bool(availability): [count, rated or 0]
+            for availability, count, rated in
+            Product.select(
+                Product.availability, fn.COUNT(Product.id_),
+                fn.SUM(Product.rated)
+            )
+            .group_by(Product.availability)
+            .tuples()
+        }
+        cls._by_tag = {
+            name: [count, rated or 0]
+            for name, count, rated in
+            TagXProduct.select(
+                Tag.name, fn.COUNT(Product.id_), fn.SUM(Product.rated)
+            )
+            .join(Tag)
+            .switch(TagXProduct)
+            .join(Product)
+            .group_by(Tag.name)
+            .tuples()
+        }
+        cls._loaded = True
+
+    @staticmethod
+    def snapshot(product: Product) -> tuple[bool, bool, list[str]]:
+        tags = [
+            name for (name,) in
+            Tag.select(Tag.name).join(TagXProduct)
+            .where(TagXProduct.product == product.id_)
+            .tuples()
+        ]
+        return bool(product.rated), bool(product.availability), tags
+
+    @classmethod
+    def _apply(cls, state: tuple[bool, bool, list[str]], sign: int):
+        rated, availability, tags = state
+        cls._rated_count += sign * rated
+        counts = cls._by_availability.setdefault(availability, [0, 0])
+        counts[0] += sign
+        counts[1] += sign * rated
+        for tag in tags:
+            counts = cls._by_tag.setdefault(tag, [0, 0])
+            counts[0] += sign
+            counts[1] += sign * rated
+
+    @classmethod
+    def record_change(
+        cls, before: tuple[bool, bool, list[str]],
+        after: tuple[bool, bool, list[str]]
+    ):
+        with cls._lock:
+            if not cls._loaded:
+                return
+            cls._apply(before, -1)
+            cls._apply(after, 1)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._loaded = False
+
+    @classmethod
+    def get(cls) -> dict[str, any]:
+        with cls._lock:
+            if not cls._loaded:
+                cls._load()
+            return {
+                'rating_progress': cls._rated_count,
+                'product_count': cls._product_count,
+                'by_availability': {
+                    str(availability).lower(): {
+                        'rating_progress': rated, 'product_count': count
+                    }
+                    for availability, (count, rated)
+                    in cls._by_availability.items()
+                },
+                'by_tag': {
+                    tag: {'rating_progress': rated, 'product_count': count}
+                    for tag, (count, rated) in cls._by_tag.items() if count
+                }
+            }
@@ -0,0 +1,30 @@
+from product import Product
+from product_index import product_index
+
+
+class RatingQueue:
+
+    DEFAULT_LIMIT: int = 10
+    MAX_LIMIT: int = 100
+
+    @classmethod
+    def next_ids(
+        cls, limit: int = DEFAULT_LIMIT, excluded: list[str] = None
+    ) -> list[str]:
+        query = (
+            Product.select(Product.id_)
+            .where(Product.rated == False)  # noqa: E712
+            .order_by(Product.created_at, Product.id_)
+            .limit(max(1, min(limit, cls.MAX_LIMIT)))
+        )
+        if excluded:
+            query = query.where(Product.id_.not_in(excluded))
+        return [id_ for (id_,) in query.tuples()]
+
+    @staticmethod
+    def serialize(ids: list[str]) -> list[dict[str, any]]:
+        products = product_index.hydrate(ids)
+        return [
+            {**values, 'plots': product.plot_urls()}
+            for product, values in zip(products, Product.to_dicts(products))
+        ]
@@ -0,0 +1,137 @@
+import os
+import time
+from threading import Lock
+
+from db.base_model import QueryCountingDatabase
+from flask import Flask, Response, current_app, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry,
+                               Counter, Gauge, Histogram, generate_latest,
+                               multiprocess)
+
+
+class RequestMetrics:
+
+    PREFIX: str = "firework"
+    LABELS: list[str] = ['method', 'route', 'status']
+    LATENCY_BUCKETS: list[float] = [
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+    ]
+    SIZE_BUCKETS: list[float] = [
+        256, 1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024
+    ]
+    QUERY_BUCKETS: list[float] = [0, 1, 2, 5, 10, 20, 50, 100, 500]
+    CACHE_COUNTERS: list[str] = ['hits', 'misses']
+    SLOW_REQUEST_ENVIRONMENT_VARIABLE: str = 'SLOW_REQUEST_SECONDS'
+    MULTIPROCESS_ENVIRONMENT_VARIABLE: str = 'PROMETHEUS_MULTIPROC_DIR'
+
+    _db: QueryCountingDatabase
+    _caches: dict[str, any]
+    _registry: CollectorRegistry
+    _durations: Histogram
+    _sizes: Histogram
+    _queries: Histogram
+    _cache_counters: dict[str, Counter]
+    _cache_sizes: Gauge
+    _reported: dict[tuple[str, str], int]
+    _slow_request_seconds: float
+    _lock: Lock
+
+    def __init__(self, db: QueryCountingDatabase, caches: dict[str, any]):
+        self._db = db
+        self._caches = caches
+        self._registry = CollectorRegistry()
+        self._durations = Histogram(
+            f"{self.PREFIX}_request_duration_seconds", "Request latency.",
+            self.LABELS, buckets=self.LATENCY_BUCKETS,
+            registry=self._registry
+        )
+        self._sizes = Histogram(
+            f"{self.PREFIX}_response_size_bytes", "Response body size.",
+            self.LABELS, buckets=self.SIZE_BUCKETS, registry=self._registry
+        )
+        self._queries = Histogram(
+            f"{self.PREFIX}_request_sql_queries", "SQL queries per request.",
+            self.LABELS, buckets=self.QUERY_BUCKETS, registry=self._registry
+        )
+        self._cache_counters = {
+            kind: Counter(
+                f"{self.PREFIX}_cache_{kind}", f"Cache {kind}.", ['cache'],
+                registry=self._registry
+            )
+            for kind in self.CACHE_COUNTERS
+        }
+        for cache_name in caches:
+            for counter in self._cache_counters.values():
+                counter.labels(cache_name)
+        self._cache_sizes = Gauge(
+            f"{self.PREFIX}_cache_size_bytes", "Cache size.", ['cache'],
+            multiprocess_mode='livesum', registry=self._registry
+        )
+        self._reported = {}
+        slow_request_seconds = os.environ.get(
+            self.SLOW_REQUEST_ENVIRONMENT_VARIABLE
+        )
+        self._slow_request_seconds = (
+            None if slow_request_seconds is None
+            else float(slow_request_seconds)
+        )
+        self._lock = Lock()
+
+    def init_app(self, app: Flask):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self._route_metrics)
+
+    def _start(self):
+        g.request_start = time.perf_counter()
+        self._db.reset_query_count()
+
+    def _report_caches(self):
+        # The caches count in plain integers; only the growth since the
+        # last report is added so that the counters stay monotonic.
+        with self._lock:
+            for cache_name, cache in self._caches.items():
+                for kind, counter in self._cache_counters.items():
+                    value = getattr(cache, kind)
+                    reported = self._reported.get((cache_name, kind), 0)
+                    if value > reported:
+                        counter.labels(cache_name).inc(value - reported)
+                        self._reported[(cache_name, kind)] = value
+                self._cache_sizes.labels(cache_name).set(cache.size)
+
+    def _finish(self, response: Response) -> Response:
+        duration = time.perf_counter() - g.request_start
+        query_count = self._db.query_count
+        route = (
+            request.url_rule.rule if request.url_rule is not None
+            else 'unmatched'
+        )
+        labels = (request.method, route, str(response.status_code))
+        self._durations.labels(*labels).observe(duration)
+        self._queries.labels(*labels).observe(query_count)
+        if response.content_length is not None:
+            self._sizes.labels(*labels).observe(response.content_length)
+        self._report_caches()
+        if (
+            self._slow_request_seconds is not None
+            and duration >= self._slow_request_seconds
+        ):
+            current_app.logger.warning(
+                "Slow request: %s %s took %.3fs with %d SQL queries: %s",
+                request.method, request.full_path.rstrip('?'), duration,
+                query_count, request.get_data(as_text=True)
+            )
+        return response
+
+    def render(self) -> bytes:
+        self._report_caches()
+        if os.environ.get(self.MULTIPROCESS_ENVIRONMENT_VARIABLE) is None:
+            return generate_latest(self._registry)
+        # Under gunicorn every worker writes its samples to the shared
+        # directory, so a scrape sees all of them whichever one answers.
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+    def _route_metrics(self) -> Response:
+        return Response(self.render(), content_type=CONTENT_TYPE_LATEST)
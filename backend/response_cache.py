@@ -0,0 +1,136 @@
+from __future__ import annotations
+import gzip
+import hashlib
+from functools import wraps
+from typing import Callable
+
+from catalog_version import CatalogVersion
+from filter_cache import FilterCache
+from flask import Response, make_response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CachedResponse:
+
+    MIN_COMPRESSION_SIZE: int = 1024
+    # Quality 11, the default, costs hundreds of milliseconds for the
+    # full catalog while barely shrinking it further.
+    BROTLI_QUALITY: int = 5
+    IDENTITY: str = 'identity'
+    GZIP: str = 'gzip'
+    BROTLI: str = 'br'
+    FORWARDED_HEADERS: list[str] = ['X-Next-Cursor', 'X-Sync-Until']
+
+    _bodies: dict[str, bytes]
+    _digest: str
+    _mimetype: str
+    _headers: dict[str, str]
+
+    def __init__(self, response: Response):
+        body = response.get_data()
+        self._bodies = {self.IDENTITY: body}
+        self._digest = hashlib.sha256(body).hexdigest()[:32]
+        self._mimetype = response.mimetype
+        self._headers = {
+            name: response.headers[name]
+            for name in self.FORWARDED_HEADERS if name in response.headers
+        }
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self._bodies.values())
+
+    def _etag(self, encoding: str) -> str:
+        return f"{self._digest}-{encoding}"
+
+    def _encodings(self) -> list[str]:
+        if len(self._bodies[self.IDENTITY]) < self.MIN_COMPRESSION_SIZE:
+            return [self.IDENTITY]
+        if brotli is None:
+            return [self.GZIP, self.IDENTITY]
+        return [self.BROTLI, self.GZIP, self.IDENTITY]
+
+    def _encoding(self) -> str:
+        for encoding in self._encodings():
+            if request.accept_encodings[encoding]:
+                return encoding
+        return self.IDENTITY
+
+    def _body(self, encoding: str) -> bytes:
+        # Variants are compressed when a client first asks for them.
+        if (body := self._bodies.get(encoding)) is None:
+            identity = self._bodies[self.IDENTITY]
+            body = self._bodies[encoding] = (
+                brotli.compress(identity, quality=self.BROTLI_QUALITY)
+                if encoding == self.BROTLI else gzip.compress(identity)
+            )
+        return body
+
+    def respond(self) -> Response:
+        encoding = self._encoding()
+        if any(
+            request.if_none_match.contains(self._etag(known_encoding))
+            for known_encoding in self._encodings()
+        ):
+            response = Response(status=304)
+        else:
+            response = Response(
+                self._body(encoding), mimetype=self._mimetype,
+                headers=self._headers
+            )
+            if encoding != self.IDENTITY:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self._etag(encoding))
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+class ResponseCache(FilterCache):
+
+    DEFAULT_MAX_BYTES: int = 64 * 1024 * 1024
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        super().__init__(max_bytes)
+
+    def _entry_size(self, key: str, response: CachedResponse) -> int:
+        return len(key) + response.size
+
+    @staticmethod
+    def request_key() -> str:
+        return hashlib.sha256(b"\0".join([
+            request.path.encode(),
+            request.query_string,
+            request.get_data()
+        ])).hexdigest()
+
+    def cached(self, view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if (
+                request.args.get('format') == 'ndjson'
+                or request.args.get('explain') == 'true'
+            ):
+                return view(*args, **kwargs)
+            key = self.request_key()
+            version = CatalogVersion.get()
+            if (cached_response := self.get(key, version)) is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                cached_response = CachedResponse(response)
+                self.put(key, version, cached_response)
+            size = cached_response.size
+            response = cached_response.respond()
+            if cached_response.size != size:
+                # Account for the newly compressed variant.
+                self.put(key, version, cached_response)
+            return response
+        return wrapper
+
+
+response_cache: ResponseCache = ResponseCache()
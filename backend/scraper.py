@@ -13,6 +13,7 @@ import requests
 from bs4 import BeautifulSoup
 from peewee import DoesNotExist
 from product import Color, ColorXProduct, Product
+from searches import MaterializedSearches
 
 
 class ProductProperties:
@@ -209,9 +210,34 @@ class Scraper:
     ]
 
     _db_lock: Lock
+    _search_changes: dict[str, dict[str, list[str]]]
 
     def __init__(self):
         self._db_lock = Lock()
+        self._search_changes = {}
+
+    def _record_search_changes(self, product: Product):
+        changes = MaterializedSearches.refresh_product(product)
+        for search_name, change in changes.items():
+            (
+                self._search_changes
+                .setdefault(search_name, {
+                    MaterializedSearches.ENTERED: [],
+                    MaterializedSearches.LEFT: []
+                })[change]
+                .append(product.name)
+            )
+
+    def _print_search_changes(self):
+        for search_name, changes in self._search_changes.items():
+            print(
+                f"{search_name}: "
+                f"{len(changes[MaterializedSearches.ENTERED])} entered, "
+                f"{len(changes[MaterializedSearches.LEFT])} left"
+            )
+            for change, product_names in changes.items():
+                for product_name in product_names:
+                    print(f"  {change}: {product_name}")
 
     def _request_soup(self, url: str) -> BeautifulSoup:
         wait_time = 0.01
@@ -322,6 +348,7 @@ class Scraper:
             self._attach_colors(product, properties)
             with self._db_lock:
                 product.save(force_insert=not exists)
+                self._record_search_changes(product)
 
         return product
 
@@ -365,8 +392,11 @@ class Scraper:
             if product not in found_products:
                 product.availability = False
                 product.save(force_insert=False)
+                self._record_search_changes(product)
 
         print(len(all_products))
+        self._print_search_changes()
+        return self._search_changes
 
 
 if __name__ == "__main__":
@@ -1,6 +1,23 @@
 import json
 import os
 
+from db.base_model import BaseModel, db
+from peewee import DoesNotExist, ForeignKeyField, TextField
+from product import Product
+from product_filter import ProductFilterEngine
+
+
+class MaterializedSearch(BaseModel):
+    name = TextField(unique=True)
+
+
+class MaterializedSearchProduct(BaseModel):
+    class Meta:
+        indexes = ((('search', 'product'), True),)
+
+    search = ForeignKeyField(MaterializedSearch, backref='search_x_product')
+    product = ForeignKeyField(Product, backref='search_x_product')
+
 
 class Searches:
 
@@ -24,6 +41,8 @@ class Searches:
     def save_search(name: str, search: dict):
         with open(f'backend/searches/{name}.json', 'w') as file:
             json.dump(search, file)
+        if MaterializedSearches.is_materialized(name):
+            MaterializedSearches.materialize(name)
 
     @staticmethod
     def delete_search(name: str):
@@ -31,3 +50,96 @@ class Searches:
             os.remove(f'backend/searches/{name}.json')
         except FileNotFoundError:
             pass
+        MaterializedSearches.dematerialize(name)
+
+
+class MaterializedSearches:
+
+    ENTERED: str = 'entered'
+    LEFT: str = 'left'
+    INSERT_BATCH_SIZE: int = 100
+
+    @staticmethod
+    def _engine(search: dict) -> ProductFilterEngine:
+        return ProductFilterEngine(search['filters'], search['inverted'])
+
+    @staticmethod
+    def get_all_names() -> list[str]:
+        return [search.name for search in MaterializedSearch.select()]
+
+    @staticmethod
+    def is_materialized(name: str) -> bool:
+        return (
+            MaterializedSearch.select()
+            .where(MaterializedSearch.name == name)
+            .exists()
+        )
+
+    @classmethod
+    def materialize(cls, name: str) -> bool:
+        if (search := Searches.get_search(name)) is None:
+            return False
+        engine = cls._engine(search)
+        engine.run()
+        with db.atomic():
+            materialized_search, _ = MaterializedSearch.get_or_create(
+                name=name
+            )
+            MaterializedSearchProduct.delete().where(
+                MaterializedSearchProduct.search == materialized_search
+            ).execute()
+            for i in range(0, len(engine.ids), cls.INSERT_BATCH_SIZE):
+                MaterializedSearchProduct.insert_many([
+                    {'search': materialized_search, 'product': id_}
+                    for id_ in engine.ids[i:i + cls.INSERT_BATCH_SIZE]
+                ]).execute()
+        return True
+
+    @staticmethod
+    def dematerialize(name: str):
+        try:
+            materialized_search = MaterializedSearch.get(
+                MaterializedSearch.name == name
+            )
+        except DoesNotExist:
+            return
+        with db.atomic():
+            MaterializedSearchProduct.delete().where(
+                MaterializedSearchProduct.search == materialized_search
+            ).execute()
+            materialized_search.delete_instance()
+
+    @staticmethod
+    def get_ids(name: str) -> list[str]:
+        return [
+            id_ for (id_,) in
+            MaterializedSearchProduct.select(MaterializedSearchProduct.product)
+            .join(MaterializedSearch)
+            .where(MaterializedSearch.name == name)
+            .tuples()
+        ]
+
+    @classmethod
+    def refresh_product(cls, product: Product) -> dict[str, str]:
+        changes = {}
+        for materialized_search in MaterializedSearch.select():
+            search = Searches.get_search(materialized_search.name)
+            if search is None:
+                continue
+            matches = len(cls._engine(search).match_ids([product.id_])) > 0
+            membership = MaterializedSearchProduct.select().where(
+                MaterializedSearchProduct.search == materialized_search,
+                MaterializedSearchProduct.product == product.id_
+            )
+            if matches and not membership.exists():
+                MaterializedSearchProduct.create(
+                    search=materialized_search, product=product.id_
+                )
+                changes[materialized_search.name] = cls.ENTERED
+            elif not matches and membership.exists():
+                MaterializedSearchProduct.delete().where(
+                    MaterializedSearchProduct.search == materialized_search,
+                    MaterializedSearchProduct.product == product.id_
+                ).execute()
+                changes[materialized_search.name] = cls.LEFT
+        return changes
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+
+class SnapshotCache:
+
+    DEFAULT_MAX_BYTES: int = 32 * 1024 * 1024
+
+    _entries: OrderedDict[tuple[str, tuple], tuple[datetime, bytes]]
+    _variants: dict[str, set[tuple[str, tuple]]]
+    _max_bytes: int
+    _bytes: int
+    _lock: Lock
+    hits: int
+    misses: int
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._entries = OrderedDict()
+        self._variants = {}
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def _pop(self, key: tuple[str, tuple]):
+        _, fragment = self._entries.pop(key)
+        self._bytes -= len(fragment)
+        variants = self._variants[key[0]]
+        variants.discard(key)
+        if not variants:
+            del self._variants[key[0]]
+
+    def get(
+        self, id_: str, updated_at: datetime, fields: tuple = None
+    ) -> bytes:
+        key = (id_, fields)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != updated_at:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(
+        self, id_: str, updated_at: datetime, fragment: bytes,
+        fields: tuple = None
+    ):
+        if len(fragment) > self._max_bytes:
+            return
+        key = (id_, fields)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (updated_at, fragment)
+            self._variants.setdefault(id_, set()).add(key)
+            self._bytes += len(fragment)
+            while self._bytes > self._max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, id_: str):
+        with self._lock:
+            for key in list(self._variants.get(id_, ())):
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._variants.clear()
+            self._bytes = 0
+
+
+snapshot_cache: SnapshotCache = SnapshotCache()
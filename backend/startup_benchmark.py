@@ -0,0 +1,96 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIRECTORY: str = os.path.dirname(os.path.abspath(__file__))
+PROBE: str = """
+import importlib
+import json
+import resource
+import sys
+import time
+
+start = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'heavy_modules': sorted(set({heavy_modules!r}) & set(sys.modules))
+}}))
+"""
+
+
+class StartupBenchmark:
+
+    RUNS: int = 5
+    HEAVY_MODULES: list[str] = [
+        'matplotlib', 'ffmpeg', 'pytube', 'requests', 'bs4'
+    ]
+    # Modules each entry point loads before it starts working: app.py
+    # and manage.py at import time, plus whatever a subcommand imports
+    # on demand.
+    TARGETS: dict[str, list[str]] = {
+        'app': ['app'],
+        'manage db_create': ['manage'],
+        'manage db_del': ['manage'],
+        'manage db_recreate': ['manage'],
+        'manage db_migrate': ['manage'],
+        'manage del_plots': ['manage'],
+        'manage create_plots': ['manage', 'matplotlib.pyplot'],
+        'manage compress_plots': ['manage'],
+        'manage download_videos': ['manage', 'ffmpeg', 'pytube'],
+        'manage export_catalog': ['manage'],
+        'manage scrape': ['manage', 'scraper']
+    }
+
+    @classmethod
+    def _probe(cls, modules: list[str]) -> dict[str, any]:
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(
+                modules=modules, heavy_modules=cls.HEAVY_MODULES
+            )],
+            cwd=os.path.dirname(BACKEND_DIRECTORY),
+            env={**os.environ, 'PYTHONPATH': BACKEND_DIRECTORY},
+            capture_output=True, text=True, check=True
+        ).stdout
+        return json.loads(output.splitlines()[-1])
+
+    @classmethod
+    def measure(cls, modules: list[str], runs: int = RUNS) -> dict[str, any]:
+        probes = [cls._probe(modules) for _ in range(runs)]
+        return {
+            'seconds': statistics.median(p['seconds'] for p in probes),
+            'max_rss_mb': statistics.median(
+                p['max_rss_kb'] for p in probes
+            ) / 1024,
+            'heavy_modules': probes[-1]['heavy_modules']
+        }
+
+    @classmethod
+    def run(cls, runs: int = RUNS) -> dict[str, dict[str, any]]:
+        return {
+            name: cls.measure(modules, runs)
+            for name, modules in cls.TARGETS.items()
+        }
+
+    @staticmethod
+    def format(results: dict[str, dict[str, any]]) -> str:
+        lines = [f"{'target':<24}{'import s':>10}{'rss MB':>10}  heavy"]
+        for name, result in results.items():
+            lines.append(
+                f"{name:<24}{result['seconds']:>10.3f}"
+                f"{result['max_rss_mb']:>10.1f}  "
+                f"{','.join(result['heavy_modules']) or '-'}"
+            )
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    results = StartupBenchmark.run()
+    print(StartupBenchmark.format(results))
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,66 @@
+import gzip
+import hashlib
+import os
+from threading import Lock
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StaticFiles:
+
+    COMPRESSIBLE_EXTENSIONS: list[str] = ['.svg']
+    ENCODINGS: dict[str, str] = {
+        'br': '.br',
+        'gzip': '.gz'
+    }
+    IDENTITY: str = 'identity'
+    DIGEST_LENGTH: int = 16
+
+    _digests: dict[str, tuple[int, int, str]] = {}
+    _lock: Lock = Lock()
+
+    @classmethod
+    def is_compressible(cls, filename: str) -> bool:
+        return os.path.splitext(filename)[1] in cls.COMPRESSIBLE_EXTENSIONS
+
+    @classmethod
+    def digest(cls, filename: str) -> str:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        with cls._lock:
+            entry = cls._digests.get(filename)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return entry[2]
+        with open(filename, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        digest = digest[:cls.DIGEST_LENGTH]
+        with cls._lock:
+            cls._digests[filename] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    @classmethod
+    def compress(cls, filename: str):
+        with open(filename, 'rb') as file:
+            content = file.read()
+        with open(filename + cls.ENCODINGS['gzip'], 'wb') as file:
+            file.write(gzip.compress(content, compresslevel=9))
+        if brotli is not None:
+            with open(filename + cls.ENCODINGS['br'], 'wb') as file:
+                file.write(brotli.compress(content))
+
+    @classmethod
+    def variant(cls, filename: str, encoding: str) -> str:
+        variant_filename = filename + cls.ENCODINGS[encoding]
+        try:
+            stale = (
+                os.stat(variant_filename).st_mtime_ns
+                < os.stat(filename).st_mtime_ns
+            )
+        except FileNotFoundError:
+            return None
+        return None if stale else variant_filename